@@ -0,0 +1,98 @@
+# auth.py - هش رمز عبور روی استخر نخ محدود (بیرون از حلقه رویداد) و توکن نشست امضاشده با HMAC
+import os
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
+import secrets
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+# این تنظیمات هنگام import خوانده می‌شوند؛ main.py فایل .env را پیش از import این ماژول بارگذاری می‌کند
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+
+# bcrypt در حین محاسبه GIL را آزاد می‌کند، پس استخر نخ واقعاً موازی است؛ سقف آن (پیش‌فرض نیمی از هسته‌ها) تعیین می‌کند
+# یک هجوم ورود حداکثر چند هسته را بگیرد و بقیه برای چت آزاد بمانند. درخواست‌های اضافه در صف استخر منتظر می‌مانند.
+AUTH_HASH_CONCURRENCY = int(os.getenv("AUTH_HASH_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2))))
+_hash_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_CONCURRENCY, thread_name_prefix="auth")
+
+@functools.lru_cache(maxsize=1)
+def session_secret() -> bytes:
+    """
+    کلید امضای توکن‌ها: SESSION_SECRET اگر تنظیم شده باشد؛ وگرنه کلیدی که یک بار ساخته و در SESSION_SECRET_FILE
+    ذخیره می‌شود تا همه workerها و راه‌اندازی‌های بعدی همان کلید را ببینند و نشست‌ها معتبر بمانند.
+    در اولین استفاده (نه هنگام import) خوانده می‌شود تا فایل کلید فقط وقتی لازم است ساخته شود.
+    """
+    secret = os.getenv("SESSION_SECRET", "").encode("utf-8")
+    if secret: return secret
+    path = os.getenv("SESSION_SECRET_FILE", "session_secret.key")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="ascii") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # link اتمی است: اگر worker دیگری هم‌زمان کلید را ساخته باشد، کلید او برای همه استفاده می‌شود
+            os.link(tmp_path, path)
+            print(f"⚠️ SESSION_SECRET تنظیم نشده است؛ کلید تصادفی ساخته و در {path} ذخیره شد.")
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, encoding="ascii") as f: secret = f.read().strip().encode("ascii")
+    if not secret: raise RuntimeError(f"فایل کلید نشست {path} خالی است؛ SESSION_SECRET را تنظیم یا فایل را حذف کنید.")
+    return secret
+
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt فقط ۷۲ بایت اول را در نظر می‌گیرد؛ passlib قبلاً همین برش را بی‌صدا انجام می‌داد و هش‌های موجود به آن وابسته‌اند
+    return password.encode("utf-8")[:72]
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(BCRYPT_ROUNDS)).decode("ascii")
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    try:
+        return bcrypt.checkpw(_password_bytes(password), hashed_password.encode("ascii"))
+    except ValueError:  # هش خراب یا با قالب ناشناخته
+        return False
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, functools.partial(func, *args))
+
+
+async def ahash_password(password: str) -> str:
+    return await _run(hash_password, password)
+
+
+async def averify_password(password: str, hashed_password: str) -> bool:
+    return await _run(verify_password, password, hashed_password)
+
+
+# --- توکن نشست: "<user_id>.<expires>.<signature>" ---
+def _sign(payload: bytes) -> bytes:
+    digest = hmac.new(session_secret(), payload, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=")
+
+
+def create_session_token(user_id: int, ttl: int = SESSION_TTL) -> str:
+    payload = f"{user_id}.{int(time.time()) + ttl}"
+    return f"{payload}.{_sign(payload.encode('ascii')).decode('ascii')}"
+
+
+def verify_session_token(token: str) -> int | None:
+    """شناسه کاربر توکن معتبر و منقضی‌نشده؛ در غیر این صورت None. بدون دسترسی به پایگاه داده."""
+    # مقایسه روی بایت‌ها انجام می‌شود تا توکن دست‌کاری‌شده با نویسه غیر ASCII به جای 401 خطای 500 ندهد
+    payload, _, signature = token.encode("utf-8", "surrogateescape").rpartition(b".")
+    if not payload or not hmac.compare_digest(signature, _sign(payload)): return None
+    user_id, _, expires = payload.partition(b".")
+    try:
+        if int(expires) < time.time(): return None
+        return int(user_id)
+    except ValueError:
+        return None
@@ -0,0 +1,7 @@
+# benchmarks/_stats.py - توابع آماری مشترک بنچمارک‌ها
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """صدک q (۰ تا ۱۰۰) به روش نزدیک‌ترین رتبه؛ برای فهرست خالی صفر."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))] if ordered else 0.0
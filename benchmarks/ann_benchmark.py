@@ -0,0 +1,71 @@
+# benchmarks/ann_benchmark.py - مقایسه انواع ایندکس FAISS روی داده مصنوعی
+# اجرا از ریشه پروژه:  python -m benchmarks.ann_benchmark --n 100000 --dim 768
+import argparse
+import time
+import numpy as np
+import faiss
+import vector_index
+
+
+def synthetic_corpus(n: int, dim: int, n_queries: int, n_clusters: int, seed: int = 0):
+    """بردارهای خوشه‌ای (شبیه embedding واقعی متن) و پرسش‌هایی نزدیک به همان خوشه‌ها می‌سازد."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    corpus = centers[rng.integers(0, n_clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    queries = centers[rng.integers(0, n_clusters, n_queries)] + 0.6 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    return vector_index.normalize(corpus), vector_index.normalize(queries)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(f[f >= 0], t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def run(index, queries: np.ndarray, k: int):
+    index.search(queries[:1], k)  # گرم کردن نخ‌های OpenMP
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    return ids, len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="recall@k، QPS و حافظه انواع ایندکس FAISS")
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--threads", type=int, default=0, help="تعداد نخ‌های FAISS (۰ = پیش‌فرض)")
+    args = parser.parse_args()
+    if args.threads: faiss.omp_set_num_threads(args.threads)
+
+    corpus, queries = synthetic_corpus(args.n, args.dim, args.queries, args.clusters)
+    print(f"corpus={args.n} dim={args.dim} queries={args.queries} k={args.k}\n")
+    print(f"{'index':<10} {'param':<14} {'build s':>8} {'MB':>9} {'QPS':>10} {f'recall@{args.k}':>10}")
+
+    truth = None
+    for index_type in vector_index.INDEX_TYPES:
+        start = time.perf_counter()
+        index = vector_index.build_index(corpus, index_type)
+        build_s = time.perf_counter() - start
+        size_mb = len(faiss.serialize_index(index)) / 2**20
+
+        if index_type.startswith("ivf"):
+            sweep = [("nprobe", v, {"nprobe": v}) for v in args.nprobe]
+        elif index_type == "hnsw":
+            sweep = [("efSearch", v, {"ef_search": v}) for v in args.ef_search]
+        else:
+            sweep = [("-", "", {})]
+
+        for name, value, params in sweep:
+            vector_index.configure_search(index, **params)
+            ids, qps = run(index, queries, args.k)
+            if truth is None: truth = ids  # اولین ایندکس (flat) مرجع دقیق است
+            param = f"{name}={value}" if value != "" else name
+            print(f"{index_type:<10} {param:<14} {build_s:>8.2f} {size_mb:>9.1f} {qps:>10.0f} {recall_at_k(ids, truth):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
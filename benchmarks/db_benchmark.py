@@ -0,0 +1,79 @@
+# benchmarks/db_benchmark.py - تأخیر endpoint /api/messages (مسیر، احراز هویت، پرسش و سریال‌سازی) زیر بار نویسنده‌های هم‌زمان
+# اجرا از ریشه پروژه:  python -m benchmarks.db_benchmark --writers 8 --readers 8 --seconds 10
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()  # DB_POOL_SIZE هنگام import ماژول database خوانده می‌شود
+import database
+import auth
+from benchmarks._stats import percentile
+
+
+async def writer(conversation_ids: list[str], deadline: float, counter: list):
+    i = 0
+    while time.perf_counter() < deadline:
+        await database.aadd_message(conversation_ids[i % len(conversation_ids)], "user", "پیام آزمایشی " * 20)
+        i += 1
+    counter.append(i)
+
+
+async def reader(client: httpx.AsyncClient, headers: dict, conversation_ids: list[str], deadline: float, latencies: list[float]):
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get(f"/api/messages/{conversation_ids[i % len(conversation_ids)]}", params={"limit": 20}, headers=headers)
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+
+
+async def run(args, app):
+    # کاربر مستقیماً درج و توکن بدون ورود ساخته می‌شود تا هزینه bcrypt در سنجش نیاید
+    with database.get_connection() as conn:
+        user_id = conn.execute("INSERT INTO users (username, hashed_password, experience, subject, field) VALUES (?, ?, ?, ?, ?)",
+                               ("bench_user", "-", 10, "شبکه", "کامپیوتر")).lastrowid
+    headers = {"Authorization": f"Bearer {auth.create_session_token(user_id)}"}
+    conversation_ids = [database.create_conversation(user_id, f"گفتگو {i}") for i in range(args.conversations)]
+    # تاریخچه اولیه تا پرسش‌ها روی جدول بزرگ اجرا شوند
+    with database.get_connection() as conn:
+        conn.executemany("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                         [(conversation_ids[i % len(conversation_ids)], "user", "پیام قدیمی " * 20) for i in range(args.history)])
+
+    deadline = time.perf_counter() + args.seconds
+    latencies, writes = [], []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        await asyncio.gather(*[writer(conversation_ids, deadline, writes) for _ in range(args.writers)],
+                             *[reader(client, headers, conversation_ids, deadline, latencies) for _ in range(args.readers)])
+
+    print(f"writers={args.writers} readers={args.readers} history={args.history} seconds={args.seconds}")
+    print(f"writes/s={sum(writes) / args.seconds:.0f}  reads/s={len(latencies) / args.seconds:.0f}")
+    print(f"GET /api/messages latency ms: p50={percentile(latencies, 50):.2f} p95={percentile(latencies, 95):.2f} "
+          f"p99={percentile(latencies, 99):.2f} max={max(latencies, default=0):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="p99 تأخیر GET /api/messages با نویسنده‌های هم‌زمان")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--history", type=int, default=200_000)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    # برنامه با ارائه‌دهنده جعلی بارگذاری می‌شود تا برای سنجش پایگاه داده کلید API لازم نباشد
+    os.environ.setdefault("AI_PROVIDER", "fake")
+    os.environ.setdefault("SESSION_SECRET", "db-benchmark")
+    import main as service
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        asyncio.run(run(args, service.app))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# benchmarks/kb_load_benchmark.py - زمان راه‌اندازی و حافظه هر worker: قالب قدیمی (pickle) در برابر پوشه نسخه‌دار mmap
+# اجرا از ریشه پروژه:  python -m benchmarks.kb_load_benchmark --chunks 100000 --dim 768 --workers 4
+import os
+import json
+import pickle
+import argparse
+import tempfile
+import subprocess
+import sys
+import numpy as np
+import faiss
+from bm25_index import BM25Index
+import knowledge_base
+import vector_index
+
+# هر worker در یک پردازه تازه بارگذاری می‌کند و پس از آماده‌شدن همه، حافظه‌اش را گزارش می‌دهد
+_WORKER = """
+import os, sys, json, time
+import numpy as np
+import knowledge_base
+os.chdir(sys.argv[1])
+before = knowledge_base.memory_usage_mb()
+start = time.perf_counter()
+kb = knowledge_base.load_legacy() if sys.argv[2] == "legacy" else knowledge_base.load_current(sys.argv[1] + "/kb")
+load_ms = (time.perf_counter() - start) * 1000
+kb.index.search(np.zeros((1, kb.index.d), dtype=np.float32), 5)
+after = knowledge_base.memory_usage_mb()
+pss = 0.0
+try:
+    with open("/proc/self/smaps_rollup") as f:
+        pss = next(int(line.split()[1]) for line in f if line.startswith("Pss:")) / 1024
+except OSError:
+    pass
+sys.stdout.write(json.dumps({"load_ms": load_ms, "rss_mb": after.get("rss_mb", 0) - before.get("rss_mb", 0),
+                             "shared_mb": after.get("shared_mb", 0), "pss_mb": pss}) + "\\n")
+sys.stdout.flush()
+sys.stdin.read()  # تا پایان سنجش زنده می‌ماند تا صفحات مشترک در PSS دیده شوند
+"""
+
+
+def build_fixture(root: str, n: int, dim: int):
+    rng = np.random.default_rng(0)
+    vectors = vector_index.normalize(rng.standard_normal((n, dim)).astype(np.float32))
+    index = vector_index.build_index(vectors, index_type="flat", ids=np.arange(n))
+    words = [f"واژه{i}" for i in range(5000)]
+    chunks = {i: {"text": " ".join(rng.choice(words, 150)), "source": "m2.pdf", "page": i // 4 + 1} for i in range(n)}
+    bm25 = BM25Index.build((c["text"].split(" ") for c in chunks.values()), doc_ids=list(chunks))
+
+    faiss.write_index(index, os.path.join(root, knowledge_base.LEGACY_FAISS_PATH))
+    with open(os.path.join(root, knowledge_base.LEGACY_CHUNKS_PATH), "wb") as f: pickle.dump(chunks, f)
+    bm25.save(os.path.join(root, knowledge_base.LEGACY_BM25_PATH))
+    knowledge_base.publish_version(index, chunks, bm25, kb_dir=os.path.join(root, "kb"))
+
+
+def measure(root: str, mode: str, workers: int) -> list[dict]:
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    procs = [subprocess.Popen([sys.executable, "-c", _WORKER, root, mode], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              text=True, env=env) for _ in range(workers)]
+    results = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.stdin.close(); p.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="زمان بارگذاری و RSS/PSS هر worker برای دو قالب پایگاه دانش")
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        build_fixture(root, args.chunks, args.dim)
+        print(f"chunks={args.chunks} dim={args.dim} workers={args.workers}")
+        print(f"{'format':<10}{'load ms':>10}{'+RSS MB':>10}{'shared MB':>12}{'PSS MB':>10}")
+        for mode in ("legacy", "versioned"):
+            results = measure(root, mode, args.workers)
+            avg = {key: sum(r[key] for r in results) / len(results) for key in results[0]}
+            print(f"{mode:<10}{avg['load_ms']:>10.0f}{avg['rss_mb']:>10.0f}{avg['shared_mb']:>12.0f}{avg['pss_mb']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/load_test.py - آزمون بار سرویس: RPS، زمان تا اولین توکن و p50/p95/p99 هر endpoint با کاربران هم‌زمان
+# ابتدا سرور را با ارائه‌دهنده جعلی اجرا کنید تا سهمیه API مصرف نشود:
+#   AI_PROVIDER=fake FAKE_TTFT_MS=300 FAKE_TOKENS_PER_SECOND=50 uvicorn main:app --port 8000
+# سپس از ریشه پروژه:  python -m benchmarks.load_test --url http://127.0.0.1:8000 --users 50 --sessions 4 --messages 3
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+import httpx
+from benchmarks._stats import percentile
+
+QUESTIONS = [
+    "شبکه کامپیوتری چیست و چه کاربردی دارد؟",
+    "تفاوت مدل OSI و TCP/IP را توضیح بده.",
+    "چطور مفهوم آدرس IP را به هنرجویان آموزش دهم؟",
+    "یک فعالیت کلاسی برای آموزش کابل‌کشی شبکه پیشنهاد بده.",
+    "روتر و سوئیچ چه تفاوتی دارند؟",
+]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)  # endpoint -> ms
+        self.errors = defaultdict(int)
+        self.ttft = []
+
+    async def timed(self, endpoint: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        return response
+
+
+async def chat(client: httpx.AsyncClient, stats: Stats, conversation_id: str, message: str, headers: dict):
+    """پاسخ جریانی را تا انتها می‌خواند؛ زمان رسیدن اولین بایت بدنه همان TTFT دیده‌شده توسط کاربر است."""
+    start = time.perf_counter()
+    first = None
+    try:
+        async with client.stream("POST", "/api/chat", json={"conversation_id": conversation_id, "message": message},
+                                 headers=headers) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                if first is None and chunk: first = time.perf_counter()
+    except httpx.HTTPError:
+        stats.errors["/api/chat"] += 1
+        return
+    end = time.perf_counter()
+    stats.latencies["/api/chat"].append((end - start) * 1000)
+    if first is not None: stats.ttft.append((first - start) * 1000)
+
+
+async def virtual_user(client: httpx.AsyncClient, stats: Stats, args):
+    """هر جلسه: ثبت‌نام، ورود، شروع گفتگو و چند پیام چت که پس از هر کدام تاریخچه خوانده می‌شود."""
+    for _ in range(args.sessions):
+        credentials = {"username": f"load-{uuid.uuid4().hex[:12]}", "password": "load-test-password"}
+        response = await stats.timed("/api/register", client.post("/api/register", json={
+            **credentials, "experience": random.randint(0, 25), "subject": "شبکه", "field": "کامپیوتر"}))
+        if response is None: continue
+        response = await stats.timed("/api/login", client.post("/api/login", json=credentials))
+        if response is None: continue
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+        first_message = random.choice(QUESTIONS)
+        response = await stats.timed("/api/start_conversation", client.post("/api/start_conversation", json={
+            "first_message": first_message}, headers=headers))
+        if response is None: continue
+        conversation_id = response.json()["conversation_id"]
+        for i in range(args.messages):
+            await chat(client, stats, conversation_id, first_message if i == 0 else random.choice(QUESTIONS), headers)
+            await stats.timed("/api/messages", client.get(f"/api/messages/{conversation_id}", params={"limit": 20}, headers=headers))
+
+
+async def run(args):
+    stats = Stats()
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(virtual_user(client, stats, args) for _ in range(args.users)))
+        elapsed = time.perf_counter() - start
+
+    print(f"users={args.users} sessions/user={args.sessions} messages/session={args.messages} elapsed={elapsed:.1f}s")
+    print(f"{'endpoint':<24}{'requests':>9}{'errors':>8}{'RPS':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint in ("/api/register", "/api/login", "/api/start_conversation", "/api/chat", "/api/messages"):
+        samples = stats.latencies[endpoint]
+        print(f"{endpoint:<24}{len(samples):>9}{stats.errors[endpoint]:>8}{len(samples) / elapsed:>9.1f}"
+              f"{percentile(samples, 50):>10.1f}{percentile(samples, 95):>10.1f}{percentile(samples, 99):>10.1f}")
+    print(f"{'chat TTFT':<24}{len(stats.ttft):>9}{'':>8}{'':>9}"
+          f"{percentile(stats.ttft, 50):>10.1f}{percentile(stats.ttft, 95):>10.1f}{percentile(stats.ttft, 99):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="آزمون بار endpoint های ثبت‌نام، ورود، گفتگو، چت و تاریخچه")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20, help="تعداد کاربران هم‌زمان")
+    parser.add_argument("--sessions", type=int, default=3, help="تعداد گفتگوی هر کاربر")
+    parser.add_argument("--messages", type=int, default=3, help="تعداد پیام چت در هر گفتگو")
+    parser.add_argument("--timeout", type=float, default=120)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# benchmarks/login_burst.py - TTFT چت در حالت عادی و هنگام هجوم ورود (هزینه bcrypt نباید چت را کند کند)
+# سرور را مانند load_test با ارائه‌دهنده جعلی اجرا کنید، سپس از ریشه پروژه:
+#   python -m benchmarks.login_burst --url http://127.0.0.1:8000 --chatters 8 --burst 64 --seconds 10
+import time
+import uuid
+import asyncio
+import argparse
+import httpx
+from benchmarks._stats import percentile
+
+PASSWORD = "login-burst-password"
+
+
+async def register_and_login(client: httpx.AsyncClient) -> tuple[str, dict]:
+    username = f"burst-{uuid.uuid4().hex[:12]}"
+    response = await client.post("/api/register", json={"username": username, "password": PASSWORD, "experience": 5,
+                                                        "subject": "شبکه", "field": "کامپیوتر"})
+    response.raise_for_status()
+    response = await client.post("/api/login", json={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return username, {"Authorization": f"Bearer {response.json()['token']}"}
+
+
+async def chatter(client: httpx.AsyncClient, headers: dict, deadline: float, ttfts: list[float]):
+    """تا پایان مرحله پشت سر هم پیام می‌فرستد؛ هر پیام متن یکتایی دارد تا از کش معنایی پاسخ داده نشود."""
+    response = await client.post("/api/start_conversation", json={"first_message": "سنجش"}, headers=headers)
+    conversation_id = response.json()["conversation_id"]
+    while time.perf_counter() < deadline:
+        start, first = time.perf_counter(), None
+        async with client.stream("POST", "/api/chat", headers=headers,
+                                 json={"conversation_id": conversation_id, "message": f"پرسش {uuid.uuid4().hex}"}) as response:
+            async for chunk in response.aiter_bytes():
+                if first is None and chunk: first = time.perf_counter()
+        if first is not None: ttfts.append((first - start) * 1000)
+
+
+async def login_loop(client: httpx.AsyncClient, username: str, deadline: float, latencies: list[float]):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.post("/api/login", json={"username": username, "password": PASSWORD})
+        if response.status_code == 200: latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def phase(client, chat_headers: list, burst_users: list, seconds: float) -> tuple[list, list]:
+    deadline = time.perf_counter() + seconds
+    ttfts, logins = [], []
+    await asyncio.gather(*(chatter(client, headers, deadline, ttfts) for headers in chat_headers),
+                         *(login_loop(client, username, deadline, logins) for username in burst_users))
+    return ttfts, logins
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.chatters + args.burst + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=120, limits=limits) as client:
+        accounts = await asyncio.gather(*(register_and_login(client) for _ in range(max(args.chatters, args.burst))))
+        chat_headers = [headers for _, headers in accounts[:args.chatters]]
+        burst_users = [username for username, _ in accounts[:args.burst]]
+
+        print(f"chatters={args.chatters} concurrent logins={args.burst} seconds/phase={args.seconds}")
+        print(f"{'phase':<14}{'chats':>7}{'TTFT p50':>10}{'TTFT p95':>10}{'TTFT p99':>10}{'logins/s':>10}{'login p50':>11}{'login p99':>11}")
+        for name, users in (("idle", []), ("login burst", burst_users)):
+            ttfts, logins = await phase(client, chat_headers, users, args.seconds)
+            print(f"{name:<14}{len(ttfts):>7}{percentile(ttfts, 50):>10.1f}{percentile(ttfts, 95):>10.1f}{percentile(ttfts, 99):>10.1f}"
+                  f"{len(logins) / args.seconds:>10.1f}{percentile(logins, 50):>11.1f}{percentile(logins, 99):>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="اثر هجوم ورود (bcrypt) بر زمان تا اولین توکن چت")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--chatters", type=int, default=8, help="کاربرانی که هم‌زمان چت می‌کنند")
+    parser.add_argument("--burst", type=int, default=64, help="تعداد درخواست ورود هم‌زمان در مرحله هجوم")
+    parser.add_argument("--seconds", type=float, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
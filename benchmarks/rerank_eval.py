@@ -0,0 +1,89 @@
+# benchmarks/rerank_eval.py - nDCG و MRR بازیابی با و بدون rerank روی مجموعه پرسش‌های برچسب‌خورده
+# اجرا از ریشه پروژه:
+#   python -m benchmarks.rerank_eval --queries labeled.jsonl --model models/reranker --top-n 10 20 40 --deadline-ms 100 300
+# هر خط labeled.jsonl:  {"query": "...", "relevant": [12, 40]}  یا با درجه ارتباط:  {"query": "...", "relevant": {"12": 2, "40": 1}}
+import os
+import json
+import math
+import time
+import argparse
+from dotenv import load_dotenv
+
+load_dotenv()  # پیش از import ماژول‌های محلی که تنظیمات (مثل KB_DIR) را هنگام import می‌خوانند
+import knowledge_base
+from llm_providers import get_llm_provider
+from reranker import CrossEncoderReranker
+from retriever import HybridRetriever
+from benchmarks._stats import percentile
+
+
+def load_queries(path: str) -> list[tuple[str, dict]]:
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip(): continue
+            item = json.loads(line)
+            relevant = item["relevant"]
+            grades = {int(k): float(v) for k, v in relevant.items()} if isinstance(relevant, dict) else {int(i): 1.0 for i in relevant}
+            queries.append((item["query"], grades))
+    return queries
+
+
+def ndcg_at_k(ranked: list[int], grades: dict, k: int) -> float:
+    dcg = sum(grades.get(doc_id, 0.0) / math.log2(rank + 2) for rank, doc_id in enumerate(ranked[:k]))
+    ideal = sum(g / math.log2(rank + 2) for rank, g in enumerate(sorted(grades.values(), reverse=True)[:k]))
+    return dcg / ideal if ideal else 0.0
+
+
+def mrr_at_k(ranked: list[int], grades: dict, k: int) -> float:
+    return next((1.0 / (rank + 1) for rank, doc_id in enumerate(ranked[:k]) if grades.get(doc_id, 0) > 0), 0.0)
+
+
+def evaluate(retriever: HybridRetriever, queries: list, vectors: list, k: int) -> dict:
+    ndcg, mrr, latencies, reranked = [], [], [], 0
+    for (query, grades), vector in zip(queries, vectors):
+        start = time.perf_counter()
+        result = retriever.retrieve(query, vector)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ndcg.append(ndcg_at_k(result.chunk_ids, grades, k)); mrr.append(mrr_at_k(result.chunk_ids, grades, k))
+        reranked += result.reranked
+    n = len(queries)
+    return {"ndcg": sum(ndcg) / n, "mrr": sum(mrr) / n, "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+            "reranked": reranked / n}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ارزیابی آفلاین rerank (nDCG@k، MRR@k و تأخیر)")
+    parser.add_argument("--queries", required=True, help="فایل JSONL پرسش‌های برچسب‌خورده")
+    parser.add_argument("--model", help="پوشه مدل ONNX (پیش‌فرض RERANK_MODEL_PATH)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--top-n", type=int, nargs="+", default=[20])
+    parser.add_argument("--deadline-ms", type=float, nargs="+", default=[150])
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    model = args.model or os.getenv("RERANK_MODEL_PATH")
+    kb = knowledge_base.load_current()
+    if kb is None: raise SystemExit("پایگاه دانش یافت نشد؛ ابتدا ingest.py را اجرا کنید.")
+    provider = get_llm_provider()
+    queries = load_queries(args.queries)
+    # embedding پرسش‌ها یک بار ساخته می‌شود تا تأخیر گزارش‌شده فقط مربوط به جستجو و rerank باشد
+    vectors = [provider.create_embedding(query) for query, _ in queries]
+
+    print(f"queries={len(queries)} k={args.k} kb={kb.version}")
+    print(f"{'config':<28}{'nDCG@k':>8}{'MRR@k':>8}{'p50 ms':>9}{'p95 ms':>9}{'reranked':>10}")
+    base = HybridRetriever(provider, kb.index, kb.chunks, kb.bm25, top_k=args.k)
+    row = evaluate(base, queries, vectors, args.k)
+    print(f"{'fused (RRF)':<28}{row['ndcg']:>8.3f}{row['mrr']:>8.3f}{row['p50']:>9.1f}{row['p95']:>9.1f}{'-':>10}")
+    if not model: return
+    for top_n in args.top_n:
+        for deadline in args.deadline_ms:
+            reranker = CrossEncoderReranker(model, top_n=top_n, deadline_ms=deadline, batch_size=args.batch_size)
+            retriever = HybridRetriever(provider, kb.index, kb.chunks, kb.bm25, top_k=args.k, reranker=reranker)
+            row = evaluate(retriever, queries, vectors, args.k)
+            print(f"{f'rerank n={top_n} deadline={deadline:.0f}':<28}{row['ndcg']:>8.3f}{row['mrr']:>8.3f}"
+                  f"{row['p50']:>9.1f}{row['p95']:>9.1f}{row['reranked']:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# benchmarks/router_benchmark.py - تأخیر دنباله‌ای TTFT با ارائه‌دهنده اصلی معیوب: فقط اصلی، failover و hedging
+# اجرا از ریشه پروژه:  python -m benchmarks.router_benchmark --requests 400 --concurrency 32 --hedge-ms 150
+import time
+import random
+import asyncio
+import argparse
+from llm_providers import FakeProvider
+from provider_router import RouterProvider
+from benchmarks._stats import percentile
+
+
+class DegradedProvider(FakeProvider):
+    """ارائه‌دهنده جعلی که درصدی از درخواست‌هایش بسیار کند است (شبیه سهمیه پر یا سرور شلوغ)."""
+    def __init__(self, slow_rate: float, slow_ttft: float, **kwargs):
+        super().__init__(**kwargs)
+        self.slow_rate, self.slow_ttft = slow_rate, slow_ttft
+
+    async def agenerate_stream(self, messages: list):
+        if random.random() < self.slow_rate: await asyncio.sleep(self.slow_ttft)
+        async for chunk in super().agenerate_stream(messages):
+            yield chunk
+
+
+async def drive(router: RouterProvider, requests: int, concurrency: int) -> tuple[list[float], int]:
+    gate = asyncio.Semaphore(concurrency)
+    ttfts, errors = [], 0
+
+    async def one():
+        nonlocal errors
+        async with gate:
+            start, first = time.perf_counter(), None
+            try:
+                async for _ in router.agenerate_stream([{"role": "user", "content": "سلام"}]):
+                    if first is None: first = time.perf_counter()
+            except ConnectionError:
+                errors += 1
+                return
+            ttfts.append((first - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return ttfts, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="اثر failover و hedging بر p99 زمان تا اولین توکن")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--ttft-ms", type=float, default=80, help="TTFT عادی هر دو ارائه‌دهنده")
+    parser.add_argument("--slow-rate", type=float, default=0.1, help="سهم درخواست‌های کند ارائه‌دهنده اصلی")
+    parser.add_argument("--slow-ms", type=float, default=3000)
+    parser.add_argument("--fail-rate", type=float, default=0.05, help="سهم خطای ارائه‌دهنده اصلی پیش از اولین توکن")
+    parser.add_argument("--first-token-timeout", type=float, default=1.0)
+    parser.add_argument("--hedge-ms", type=float, default=150)
+    args = parser.parse_args()
+
+    def providers():
+        primary = DegradedProvider(args.slow_rate, args.slow_ms / 1000, ttft=args.ttft_ms / 1000, tokens_per_second=500,
+                                   response_tokens=20, fail_rate=args.fail_rate)
+        backup = FakeProvider(ttft=args.ttft_ms / 1000, tokens_per_second=500, response_tokens=20)
+        return [("primary", primary), ("backup", backup)]
+
+    configs = [
+        ("primary only", lambda: RouterProvider(providers()[:1], max_concurrency=args.concurrency, first_token_timeout=60)),
+        ("failover", lambda: RouterProvider(providers(), max_concurrency=args.concurrency, first_token_timeout=args.first_token_timeout)),
+        (f"failover + hedge {args.hedge_ms:.0f}ms", lambda: RouterProvider(providers(), max_concurrency=args.concurrency,
+                                                                          first_token_timeout=args.first_token_timeout, hedge_after_ms=args.hedge_ms)),
+    ]
+    print(f"requests={args.requests} concurrency={args.concurrency} slow={args.slow_rate:.0%}@{args.slow_ms:.0f}ms fail={args.fail_rate:.0%}")
+    print(f"{'config':<26}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, make in configs:
+        random.seed(0)
+        ttfts, errors = asyncio.run(drive(make(), args.requests, args.concurrency))
+        print(f"{name:<26}{errors:>8}{percentile(ttfts, 50):>10.1f}{percentile(ttfts, 95):>10.1f}"
+              f"{percentile(ttfts, 99):>10.1f}{max(ttfts, default=0):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
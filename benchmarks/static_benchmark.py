@@ -0,0 +1,115 @@
+# benchmarks/static_benchmark.py - بایت منتقل‌شده و تأخیر بارگذاری صفحه: StaticFiles و خواندن از دیسک در برابر static_assets
+# اجرا از ریشه پروژه:  python -m benchmarks.static_benchmark --page / --repeat 200 --kbps 512
+import re
+import time
+import asyncio
+import argparse
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse
+from fastapi.staticfiles import StaticFiles
+from static_assets import StaticAssets
+from benchmarks._stats import percentile
+
+_REF = re.compile(r"""(/static/[\w./-]+(?:\?v=\w+)?)""")
+
+
+def baseline_app() -> FastAPI:
+    """رفتار قبلی: صفحه‌ها در هر درخواست از دیسک خوانده می‌شوند و /static بدون فشرده‌سازی سرو می‌شود."""
+    app = FastAPI()
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    @app.get("/", response_class=HTMLResponse)
+    async def login_page():
+        with open("static/login.html", encoding="utf-8") as f: return f.read()
+
+    @app.get("/app.html", response_class=HTMLResponse)
+    async def app_page():
+        with open("static/app.html", encoding="utf-8") as f: return f.read()
+    return app
+
+
+def assets_app() -> FastAPI:
+    app = FastAPI()
+    assets = StaticAssets("static")
+
+    @app.get("/static/{path:path}")
+    async def static(request: Request, path: str): return assets.response(request, path)
+
+    @app.get("/")
+    async def login_page(request: Request): return assets.response(request, "login.html")
+
+    @app.get("/app.html")
+    async def app_page(request: Request): return assets.response(request, "app.html")
+    return app
+
+
+class Browser:
+    """کش ساده مرورگر: پاسخ immutable دوباره درخواست نمی‌شود، بقیه با If-None-Match بازبینی می‌شوند."""
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.cache = {}  # url -> (etag, immutable, text)
+        self.latencies = []
+
+    async def get(self, url: str) -> tuple[str, int]:
+        cached = self.cache.get(url)
+        if cached and cached[1]: return cached[2], 0
+        headers = {"Accept-Encoding": "gzip, br"}
+        if cached and cached[0]: headers["If-None-Match"] = cached[0]
+        start = time.perf_counter()
+        response = await self.client.get(url, headers=headers)
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code == 304: return cached[2], response.num_bytes_downloaded
+        text = response.text if "text" in response.headers.get("content-type", "") else ""
+        self.cache[url] = (response.headers.get("etag"), "immutable" in response.headers.get("cache-control", ""), text)
+        return text, response.num_bytes_downloaded
+
+    async def load_page(self, page: str) -> tuple[int, int]:
+        """صفحه و همه ارجاع‌های /static آن (و فونت‌های داخل CSS) را بار می‌کند؛ (بایت بدنه، تعداد درخواست)."""
+        requests_before = len(self.latencies)
+        html, total = await self.get(page)
+        pending, seen = _REF.findall(html), set()
+        while pending:
+            url = pending.pop()
+            if url in seen: continue
+            seen.add(url)
+            text, size = await self.get(url)
+            total += size
+            pending.extend(_REF.findall(text))
+        return total, len(self.latencies) - requests_before
+
+
+async def measure(name: str, app: FastAPI, page: str, repeat: int, kbps: float):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        browser = Browser(client)
+        first_bytes, first_requests = await browser.load_page(page)
+        repeat_bytes, repeat_requests = await browser.load_page(page)
+        # تأخیر هر درخواست در سرور: بازدید اول (بدون کش مرورگر) و بازدید دوباره (درخواست‌های شرطی)
+        cold, warm = [], []
+        for _ in range(repeat):
+            fresh = Browser(client)
+            await fresh.load_page(page)
+            cold.extend(fresh.latencies)
+            browser.latencies.clear()
+            await browser.load_page(page)
+            warm.extend(browser.latencies)
+    print(f"{name:<14}{first_requests:>7}{first_bytes / 1024:>10.1f}{first_bytes * 8 / kbps:>10.0f}{repeat_requests:>8}"
+          f"{repeat_bytes / 1024:>10.2f}{percentile(cold, 50):>10.2f}{percentile(cold, 99):>10.2f}{percentile(warm, 50):>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="بایت و تأخیر بارگذاری صفحه در بازدید اول و بازدید دوباره")
+    parser.add_argument("--page", default="/", help="/ (ورود) یا /app.html")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--kbps", type=float, default=512, help="پهنای باند فرضی برای تخمین زمان انتقال بازدید اول")
+    args = parser.parse_args()
+
+    print(f"page={args.page} repeat={args.repeat} link={args.kbps:.0f} kbit/s")
+    print(f"{'':<14}{'first visit':>27}{'repeat visit':>18}{'request latency ms':>30}")
+    print(f"{'server':<14}{'reqs':>7}{'KB':>10}{'xfer ms':>10}{'reqs':>8}{'KB':>10}{'cold p50':>10}{'cold p99':>10}{'warm p50':>10}")
+    asyncio.run(measure("StaticFiles", baseline_app(), args.page, args.repeat, args.kbps))
+    asyncio.run(measure("static_assets", assets_app(), args.page, args.repeat, args.kbps))
+
+
+if __name__ == "__main__":
+    main()
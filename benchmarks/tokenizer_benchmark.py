@@ -0,0 +1,35 @@
+# benchmarks/tokenizer_benchmark.py - سرعت توکن‌سازی و اندازه واژگان: split(" ") در برابر persian_text
+# اجرا از ریشه پروژه:  python -m benchmarks.tokenizer_benchmark --pdf knowledge_base/m2.pdf
+import time
+import argparse
+from collections import Counter
+from pypdf import PdfReader
+import persian_text
+
+
+def measure(name: str, tokenize, pages: list[str], repeat: int):
+    tokens = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        tokens = [t for page in pages for t in tokenize(page)]
+    elapsed = (time.perf_counter() - start) / repeat
+    vocab = Counter(tokens)
+    print(f"{name:<22}{len(tokens):>10}{len(tokens) / elapsed:>14,.0f}{len(vocab):>8}{sum(c == 1 for c in vocab.values()):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="توکن در ثانیه و اندازه واژگان BM25 برای دو روش توکن‌سازی")
+    parser.add_argument("--pdf", default="knowledge_base/m2.pdf")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = [page.extract_text() or "" for page in PdfReader(args.pdf).pages]
+    print(f"{args.pdf}: {len(pages)} صفحه، {sum(len(p) for p in pages)} نویسه")
+    print(f"{'tokenizer':<22}{'tokens':>10}{'tokens/sec':>14}{'vocab':>8}{'hapax':>10}")
+    measure('split(" ")', lambda text: text.split(" "), pages, args.repeat)
+    measure(persian_text.tokenizer_version(False), lambda text: persian_text.tokenize(text, stem=False), pages, args.repeat)
+    measure(persian_text.tokenizer_version(True), lambda text: persian_text.tokenize(text, stem=True), pages, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
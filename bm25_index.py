@@ -0,0 +1,172 @@
+# bm25_index.py - ایندکس معکوس فشرده BM25 با آرایه‌های CSR قابل بارگذاری به صورت mmap
+import os
+import json
+import shutil
+from collections import Counter
+import numpy as np
+
+# فایل‌های تشکیل‌دهنده ایندکس در پوشه مقصد
+_ARRAYS = ("indptr", "indices", "tfs", "idf", "doc_norm", "doc_len", "doc_ids")
+
+
+class BM25Index:
+    """
+    ایندکس BM25 (مشابه BM25Okapi) با ساختار:
+    - vocab: نگاشت واژه به شماره سطر
+    - indptr/indices/tfs: postings هر واژه در قالب CSR (شماره سند و تکرار واژه)
+    - idf و doc_norm: مقادیر از پیش محاسبه شده برای هر واژه و هر سند
+    - doc_ids: شناسه بیرونی هر سند (برای نگاشت به تکه‌ها)
+    - tokenizer: نسخه توکن‌ساز اسناد (persian_text.tokenizer_version)؛ None برای ایندکس‌های ساخته‌شده با split(" ")
+    """
+    def __init__(self, vocab: dict, arrays: dict, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 tokenizer: str = None):
+        self.vocab = vocab
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.tokenizer = tokenizer
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    # --- ساخت ---
+    @staticmethod
+    def _postings(tokenized_docs, vocab: dict, row_offset: int = 0):
+        """اسناد توکن‌شده را به سه ستون COO (واژه، سند، تکرار) و طول اسناد تبدیل می‌کند؛ vocab درجا گسترش می‌یابد."""
+        term_col, doc_col, tf_col, doc_len = [], [], [], []
+        for row, tokens in enumerate(tokenized_docs, start=row_offset):
+            doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_col.append(vocab.setdefault(term, len(vocab)))
+                doc_col.append(row)
+                tf_col.append(tf)
+        return (np.array(term_col, dtype=np.int64), np.array(doc_col, dtype=np.int32),
+                np.array(tf_col, dtype=np.float32), np.array(doc_len, dtype=np.float32))
+
+    @classmethod
+    def build(cls, tokenized_docs, doc_ids=None, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+              tokenizer: str = None):
+        vocab = {}
+        term_col, doc_col, tf_col, doc_len = cls._postings(tokenized_docs, vocab)
+        if doc_ids is None: doc_ids = np.arange(len(doc_len), dtype=np.int64)
+        return cls._from_coo(vocab, term_col, doc_col, tf_col, doc_len,
+                             np.asarray(doc_ids, dtype=np.int64), k1, b, epsilon, tokenizer)
+
+    def update(self, remove_ids=(), tokenized_docs=(), doc_ids=()):
+        """
+        ایندکس جدیدی با حذف اسناد remove_ids و افزودن اسناد جدید برمی‌گرداند.
+        postings موجود بدون توکن‌سازی دوباره فیلتر و ادغام می‌شوند و IDF و نرمال‌سازی طول از نو محاسبه می‌شود.
+        """
+        keep = ~np.isin(self.doc_ids, np.asarray(remove_ids, dtype=np.int64))
+        new_row = np.cumsum(keep) - 1
+        term_col = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        kept = keep[self.indices]
+
+        vocab = dict(self.vocab)
+        add_terms, add_docs, add_tfs, add_len = self._postings(tokenized_docs, vocab, row_offset=int(keep.sum()))
+        return self._from_coo(
+            vocab,
+            np.concatenate((term_col[kept], add_terms)),
+            np.concatenate((new_row[self.indices[kept]].astype(np.int32), add_docs)),
+            np.concatenate((self.tfs[kept], add_tfs)),
+            np.concatenate((self.doc_len[keep], add_len)),
+            np.concatenate((self.doc_ids[keep], np.asarray(doc_ids, dtype=np.int64))),
+            self.k1, self.b, self.epsilon, self.tokenizer)
+
+    @classmethod
+    def from_okapi(cls, okapi):
+        """تبدیل یک شیء قدیمی rank_bm25.BM25Okapi (فایل bm25_index.pkl) به قالب جدید."""
+        vocab = {}
+        term_col, doc_col, tf_col = [], [], []
+        for row, freqs in enumerate(okapi.doc_freqs):
+            for term, tf in freqs.items():
+                term_col.append(vocab.setdefault(term, len(vocab)))
+                doc_col.append(row)
+                tf_col.append(tf)
+        doc_len = np.asarray(okapi.doc_len, dtype=np.float32)
+        return cls._from_coo(vocab, np.array(term_col, dtype=np.int64), np.array(doc_col, dtype=np.int32),
+                             np.array(tf_col, dtype=np.float32), doc_len,
+                             np.arange(len(doc_len), dtype=np.int64), okapi.k1, okapi.b, okapi.epsilon)
+
+    @classmethod
+    def _from_coo(cls, vocab, term_col, doc_col, tf_col, doc_len, doc_ids, k1, b, epsilon, tokenizer=None):
+        counts = np.bincount(term_col, minlength=len(vocab))
+        if (counts == 0).any():
+            # واژه‌هایی که همه اسنادشان حذف شده از واژگان کنار گذاشته می‌شوند
+            used = counts > 0
+            remap = np.cumsum(used) - 1
+            vocab = {term: int(remap[i]) for term, i in vocab.items() if used[i]}
+            term_col, counts = remap[term_col], counts[used]
+        order = np.argsort(term_col, kind="stable")
+        arrays = {
+            "indptr": np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+            "indices": doc_col[order],
+            "tfs": tf_col[order],
+            "doc_len": doc_len,
+            "doc_ids": doc_ids,
+        }
+        index = cls(vocab, {**arrays, "idf": None, "doc_norm": None}, k1, b, epsilon, tokenizer)
+        index._compute_norms(counts)
+        return index
+
+    def _compute_norms(self, doc_freq: np.ndarray):
+        # IDF مانند BM25Okapi: مقادیر منفی با epsilon * میانگین IDF جایگزین می‌شوند
+        n = self.n_docs
+        idf = np.log(n - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        floor = self.epsilon * idf.mean() if len(idf) else 0.0
+        self.idf = np.where(idf < 0, floor, idf).astype(np.float32)
+        avgdl = self.doc_len.mean() if n else 1.0
+        self.doc_norm = (self.k1 * (1 - self.b + self.b * self.doc_len / avgdl)).astype(np.float32)
+
+    # --- ذخیره و بارگذاری ---
+    def save(self, path: str):
+        tmp_path, old_path = path + ".tmp", path + ".old"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp_path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "epsilon": self.epsilon, "tokenizer": self.tokenizer}, f)
+        # جایگزینی پوشه قبلی تا خواننده‌ها هرگز ایندکس نیمه‌کاره نبینند
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path): os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """آرایه‌ها با mmap_mode='r' باز می‌شوند تا چند پردازه uvicorn صفحات حافظه را به اشتراک بگذارند."""
+        mmap_mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in _ARRAYS}
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f: vocab = json.load(f)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f: meta = json.load(f)
+        return cls(vocab, arrays, **meta)
+
+    # --- جستجو ---
+    def search(self, query_tokens: list[str], top_k: int):
+        """
+        k سند برتر را به صورت (doc_ids, scores) برمی‌گرداند.
+        هزینه فقط به تعداد postings واژه‌های پرسش بستگی دارد، نه به اندازه کل مجموعه.
+        """
+        term_ids = [self.vocab[t] for t in query_tokens if t in self.vocab]
+        if not term_ids or top_k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # واژه‌های تکراری پرسش، مانند BM25Okapi، چند بار شمرده می‌شوند
+        term_ids, counts = np.unique(np.array(term_ids, dtype=np.int64), return_counts=True)
+        starts, sizes = self.indptr[term_ids], self.indptr[term_ids + 1] - self.indptr[term_ids]
+        positions = np.arange(sizes.sum()) + np.repeat(starts - (np.cumsum(sizes) - sizes), sizes)
+
+        rows = self.indices[positions]
+        tfs = self.tfs[positions]
+        weights = np.repeat(self.idf[term_ids] * counts, sizes)
+        contrib = weights * tfs * (self.k1 + 1) / (tfs + self.doc_norm[rows])
+
+        touched, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=contrib).astype(np.float32)
+        n = min(top_k, len(touched))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return np.asarray(self.doc_ids[touched[top]]), scores[top]
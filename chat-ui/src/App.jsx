@@ -24,7 +24,7 @@ function App() {
 
   const loadConversations = async () => {
     try {
-      const userConversations = await apiService.getConversations(user.id);
+      const userConversations = await apiService.getConversations();
       setConversations(userConversations);
     } catch (error) {
       console.error('Error loading conversations:', error);
@@ -79,7 +79,7 @@ function App() {
 
       // Create new conversation if needed
       if (!currentConversationId) {
-        const response = await apiService.startConversation(user.id, messageContent);
+        const response = await apiService.startConversation(messageContent);
         currentConversationId = response.conversation_id;
         setSelectedConversationId(currentConversationId);
         
@@ -135,6 +135,7 @@ function App() {
   };
 
   const handleLogout = () => {
+    apiService.logout();
     setUser(null);
     setMessages([]);
     setConversations([]);
@@ -144,7 +145,7 @@ function App() {
   const handleSendFeedback = async (messageId, rating) => {
     try {
       if (user && user.id) {
-        await apiService.sendFeedback(messageId, user.id, rating);
+        await apiService.sendFeedback(messageId, rating);
         console.log(`Feedback sent for message ${messageId} with rating ${rating}`);
         // Optionally, update UI to show feedback was sent
       } else {
@@ -4,16 +4,19 @@ const API_BASE_URL = 'http://localhost:8000';
 class ApiService {
   constructor() {
     this.baseURL = API_BASE_URL;
+    // Session token issued by /api/login, sent as a Bearer token instead of user_id
+    this.token = null;
   }
 
   async request(endpoint, options = {}) {
     const url = `${this.baseURL}${endpoint}`;
     const config = {
+      ...options,
       headers: {
         'Content-Type': 'application/json',
+        ...(this.token ? { Authorization: `Bearer ${this.token}` } : {}),
         ...options.headers,
       },
-      ...options,
     };
 
     try {
@@ -51,38 +54,43 @@ class ApiService {
   }
 
   async login(credentials) {
-    return this.request('/api/login', {
+    const response = await this.request('/api/login', {
       method: 'POST',
       body: JSON.stringify({
         username: credentials.mobile,
         password: credentials.password,
       }),
     });
+    this.token = response.token;
+    return response;
+  }
+
+  logout() {
+    this.token = null;
   }
 
   // Conversation APIs
-  async getConversations(userId) {
-    return this.request(`/api/conversations/${userId}`);
+  async getConversations() {
+    return this.request('/api/conversations');
   }
 
-  async startConversation(userId, firstMessage) {
+  async startConversation(firstMessage) {
     return this.request('/api/start_conversation', {
       method: 'POST',
       body: JSON.stringify({
-        user_id: userId,
         first_message: firstMessage,
       }),
     });
   }
 
-  async getMessages(conversationId, page = 1, limit = 20) {
-    return this.request(`/api/messages/${conversationId}?page=${page}&limit=${limit}`);
+  async getMessages(conversationId, limit = 20, beforeId = null) {
+    const cursor = beforeId ? `&before_id=${beforeId}` : '';
+    return this.request(`/api/messages/${conversationId}?limit=${limit}${cursor}`);
   }
 
-  async deleteConversation(conversationId, userId) {
+  async deleteConversation(conversationId) {
     return this.request(`/api/conversations/${conversationId}`, {
       method: 'DELETE',
-      body: JSON.stringify({ user_id: userId }),
     });
   }
 
@@ -99,12 +107,11 @@ class ApiService {
   }
 
   // Feedback API
-  async sendFeedback(messageId, userId, rating) {
+  async sendFeedback(messageId, rating) {
     return this.request('/api/feedback', {
       method: 'POST',
       body: JSON.stringify({
         message_id: messageId,
-        user_id: userId,
         rating: rating,
       }),
     });
@@ -0,0 +1,132 @@
+# context_builder.py - چیدن پرامپت چت در بودجه توکن، با خلاصه غلتان به جای پیام‌های قدیمی
+import os
+import asyncio
+import contextvars
+from dataclasses import dataclass, field
+import database
+import prompt_manager
+
+# هزینه تقریبی قالب هر پیام (نقش و جداکننده‌ها) در APIهای چت
+MESSAGE_OVERHEAD_TOKENS = 4
+# پیامی که جا نشود، اگر دست‌کم این مقدار بودجه مانده باشد، کوتاه شده فرستاده می‌شود
+MIN_TRUNCATED_TOKENS = 200
+
+
+@dataclass
+class BuiltContext:
+    messages: list = field(default_factory=list)
+    prompt_tokens: int = 0
+    history_used: int = 0
+    history_dropped: int = 0
+    chunks_used: int = 0
+    chunks_dropped: int = 0
+
+
+class ContextBuilder:
+    """
+    دستورالعمل سیستمی، خلاصه گفتگو، پیام‌های اخیر و تکه‌های بازیابی شده را در CONTEXT_TOKEN_BUDGET جا می‌دهد.
+    دستورالعمل سیستمی و پیام کاربر همیشه حفظ می‌شوند؛ از باقی بودجه حداکثر CONTEXT_RETRIEVAL_SHARE به تکه‌ها
+    (به ترتیب رتبه) و بقیه به تاریخچه (از جدید به قدیم) می‌رسد.
+    """
+    def __init__(self, llm_provider, budget: int = None, retrieval_share: float = None):
+        self.llm_provider = llm_provider
+        self.budget = budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        self.retrieval_share = retrieval_share if retrieval_share is not None else float(os.getenv("CONTEXT_RETRIEVAL_SHARE", "0.5"))
+
+    def _tokens(self, text: str) -> int:
+        return self.llm_provider.count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """ابتدای متن را تا جایی که در max_tokens جا شود نگه می‌دارد."""
+        while text and self.llm_provider.count_tokens(text + " …") > max_tokens:
+            text = text[:len(text) * max_tokens // (self.llm_provider.count_tokens(text) + 1) - 1]
+        return text + " …"
+
+    def build(self, system_instruction: str, user_message: str, history: list[dict],
+              retrieved_chunks: list[str], summary: str = "") -> BuiltContext:
+        result = BuiltContext()
+        if summary:
+            # خلاصه به انتهای دستورالعمل سیستمی اضافه می‌شود تا ابتدای آن برای همه درخواست‌ها ثابت بماند
+            system_instruction = f"{system_instruction}\n# خلاصه بخش‌های قبلی این گفتگو\n{summary}\n"
+        used = self._tokens(system_instruction) + self._tokens(prompt_manager.create_final_prompt_with_context(user_message, ""))
+        remaining = max(0, self.budget - used)
+
+        selected, context_budget = [], int(remaining * self.retrieval_share)
+        for chunk in retrieved_chunks:
+            cost = self.llm_provider.count_tokens(chunk) + 2
+            if cost > context_budget: break
+            selected.append(chunk); context_budget -= cost; remaining -= cost
+        result.chunks_used, result.chunks_dropped = len(selected), len(retrieved_chunks) - len(selected)
+
+        kept = []
+        for msg in reversed(history):
+            cost = self._tokens(msg["content"])
+            if cost > remaining:
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    kept.append({**msg, "content": self._truncate(msg["content"], remaining - MESSAGE_OVERHEAD_TOKENS)})
+                break
+            kept.append(msg); remaining -= cost
+        kept.reverse()
+        result.history_used, result.history_dropped = len(kept), len(history) - len(kept)
+
+        result.messages = [{"role": "system", "content": system_instruction}]
+        for msg in kept:
+            role = "assistant" if msg["role"] == "model" else msg["role"]
+            result.messages.append({"role": role, "content": msg["content"]})
+        result.messages.append({"role": "user", "content": prompt_manager.create_final_prompt_with_context(user_message, "\n\n".join(selected))})
+        result.prompt_tokens = sum(self._tokens(m["content"]) for m in result.messages)
+        return result
+
+
+class ConversationSummarizer:
+    """
+    خلاصه غلتان هر گفتگو را در جدول conversation_summaries نگه می‌دارد. وقتی بیش از
+    SUMMARY_KEEP_MESSAGES + SUMMARY_TRIGGER_MESSAGES پیام خلاصه نشده وجود داشته باشد، همه به جز
+    SUMMARY_KEEP_MESSAGES پیام آخر در پس‌زمینه به خلاصه اضافه می‌شوند.
+    """
+    def __init__(self, llm_provider, keep_messages: int = None, trigger_messages: int = None,
+                 max_batch: int = 40, max_message_chars: int = 2000):
+        self.llm_provider = llm_provider
+        self.keep_messages = keep_messages or int(os.getenv("SUMMARY_KEEP_MESSAGES", "4"))
+        self.trigger_messages = trigger_messages or int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "4"))
+        self.max_batch = max_batch
+        self.max_message_chars = max_message_chars
+        self._in_flight = set()
+        self._tasks = set()
+
+    async def get(self, conversation_id: str) -> tuple[str, int]:
+        return await database.aget_conversation_summary(conversation_id)
+
+    async def refresh(self, conversation_id: str) -> bool:
+        """در صورت نیاز خلاصه را به‌روز می‌کند؛ True اگر خلاصه جدیدی ذخیره شد."""
+        if conversation_id in self._in_flight: return False
+        self._in_flight.add(conversation_id)
+        try:
+            summary, last_id = await database.aget_conversation_summary(conversation_id)
+            pending = await database.aget_messages(conversation_id, self.max_batch, after_id=last_id)
+            if len(pending) <= self.keep_messages + self.trigger_messages: return False
+            to_summarize = pending[:-self.keep_messages]
+            # پاسخ‌های خیلی طولانی کوتاه می‌شوند تا هزینه خلاصه‌سازی محدود بماند
+            prompt = prompt_manager.create_summary_prompt(summary, [
+                {"role": m["role"], "content": m["content"][:self.max_message_chars]} for m in to_summarize])
+            parts = []
+            async for chunk in self.llm_provider.agenerate_stream([{"role": "user", "content": prompt}]):
+                parts.append(chunk)
+            new_summary = "".join(parts).strip()
+            if not new_summary: return False
+            await database.asave_conversation_summary(conversation_id, new_summary, to_summarize[-1]["id"])
+            return True
+        finally:
+            self._in_flight.discard(conversation_id)
+
+    def schedule(self, conversation_id: str, on_error=None):
+        """refresh را در پس‌زمینه اجرا می‌کند تا پاسخ کاربر منتظر خلاصه‌سازی نماند."""
+        # task در context خالی ساخته می‌شود تا فراخوانی مدل برای خلاصه در trace درخواستی که تمام شده ثبت نشود
+        task = contextvars.Context().run(asyncio.create_task, self.refresh(conversation_id))
+        self._tasks.add(task)
+
+        def _done(t):
+            self._tasks.discard(t)
+            if not t.cancelled() and t.exception() is not None and on_error: on_error(t.exception())
+        task.add_done_callback(_done)
+        return task
@@ -1,12 +1,73 @@
-import sqlite3
+import os
 import uuid
-from passlib.context import CryptContext
+import asyncio
+import sqlite3
+import functools
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 DB_NAME = "teacher_assistant.db"
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# هر نخ یک اتصال ماندگار دارد؛ نسخه‌های async روی یک استخر نخ محدود اجرا می‌شوند
+# (DB_POOL_SIZE هنگام import خوانده می‌شود، پس .env باید پیش از import این ماژول بارگذاری شده باشد)
+_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("DB_POOL_SIZE", "8")), thread_name_prefix="db")
+
+class _LRUCache:
+    """
+    کش کوچک LRU و امن برای نخ‌ها (برای داده‌هایی که در هر پیام چت خوانده می‌شوند).
+    هر ورودی پس از ttl ثانیه منقضی می‌شود تا تغییری که worker دیگری انجام داده دیر یا زود دیده شود.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None: return None
+            if item[1] < time.monotonic():
+                del self._data[key]; return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock: self._data.pop(key, None)
+
+# پروفایل کاربر با update_user_profile و گفتگو با delete_conversation در همین پردازه فوراً باطل می‌شود؛
+# workerهای دیگر تغییر را حداکثر پس از PROFILE_CACHE_TTL ثانیه می‌بینند
+_PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "4096"))
+_PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "10"))
+_conversation_owners = _LRUCache(_PROFILE_CACHE_SIZE, _PROFILE_CACHE_TTL)
+_profiles = _LRUCache(_PROFILE_CACHE_SIZE, _PROFILE_CACHE_TTL)
+
+def get_connection() -> sqlite3.Connection:
+    """اتصال نخ جاری را (در صورت نیاز با تنظیمات WAL و pragmaهای کارایی) برمی‌گرداند."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.db_name != DB_NAME:
+        conn = sqlite3.connect(DB_NAME, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        _local.conn, _local.db_name = conn, DB_NAME
+    return conn
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     cursor = conn.cursor()
     # جدول کاربران
     cursor.execute("""
@@ -48,79 +109,147 @@ def init_db():
         FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE,
         FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
     )""")
+    # جدول خلاصه گفتگوها (خلاصه پیام‌ها تا last_message_id)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS conversation_summaries (
+        conversation_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        last_message_id INTEGER NOT NULL,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+    )""")
+    # ایندکس‌های مسیرهای پرتکرار (تاریخچه پیام‌ها، فهرست گفتگوها، بازخورد)
+    # صفحه‌بندی پیام‌ها بر اساس شناسه است، پس ایندکس (conversation_id, id) جایگزین ایندکس timestamp می‌شود
+    cursor.execute("DROP INDEX IF EXISTS idx_messages_conversation_timestamp")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations (user_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_feedback_message_user ON feedback (message_id, user_id)")
     conn.commit()
-    conn.close()
+    cursor.execute("PRAGMA optimize")
     print("✅ پایگاه داده SQLite با تمام جداول (شامل بازخورد) مقداردهی اولیه شد.")
 
 def get_user(username: str):
-    conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row
-    cursor = conn.cursor(); cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone(); conn.close(); return user
+    cursor = get_connection().execute("SELECT * FROM users WHERE username = ?", (username,))
+    return cursor.fetchone()
 
-def create_user(username, password, experience, subject, field):
-    hashed_password = pwd_context.hash(password)
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def create_user(username, hashed_password, experience, subject, field):
+    """hashed_password از auth.hash_password می‌آید تا هزینه bcrypt نخ‌های پایگاه داده را اشغال نکند."""
+    conn = get_connection()
     try:
-        cursor.execute("INSERT INTO users (username, hashed_password, experience, subject, field) VALUES (?, ?, ?, ?, ?)",(username, hashed_password, experience, subject, field))
-        conn.commit(); user_id = cursor.lastrowid; conn.close(); return {"id": user_id, "username": username}
+        with conn:
+            cursor = conn.execute("INSERT INTO users (username, hashed_password, experience, subject, field) VALUES (?, ?, ?, ?, ?)",(username, hashed_password, experience, subject, field))
+        return {"id": cursor.lastrowid, "username": username}
     except sqlite3.IntegrityError:
-        conn.close(); return None
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+        return None
 
 def create_conversation(user_id, title):
     conv_id = str(uuid.uuid4())
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor(); cursor.execute("INSERT INTO conversations (id, user_id, title) VALUES (?, ?, ?)", (conv_id, user_id, title))
-    conn.commit(); conn.close(); return conv_id
+    with get_connection() as conn:
+        conn.execute("INSERT INTO conversations (id, user_id, title) VALUES (?, ?, ?)", (conv_id, user_id, title))
+    return conv_id
 
 def get_user_conversations(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor(); cursor.execute("SELECT id, title FROM conversations WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
-    conversations = [{"id": row[0], "title": row[1]} for row in cursor.fetchall()]; conn.close(); return conversations
+    cursor = get_connection().execute("SELECT id, title FROM conversations WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
+    return [{"id": row[0], "title": row[1]} for row in cursor.fetchall()]
 
 def get_user_by_conversation(conversation_id: str):
-    conn = sqlite3.connect(DB_NAME); conn.row_factory = sqlite3.Row
-    cursor = conn.cursor(); cursor.execute("""SELECT u.* FROM users u JOIN conversations c ON u.id = c.user_id WHERE c.id = ?""", (conversation_id,))
-    user_info = cursor.fetchone(); conn.close(); return user_info
+    cursor = get_connection().execute("""SELECT u.* FROM users u JOIN conversations c ON u.id = c.user_id WHERE c.id = ?""", (conversation_id,))
+    return cursor.fetchone()
+
+def get_profile_by_conversation(conversation_id: str):
+    """
+    پروفایل مالک گفتگو (id، username، experience، subject، field) بدون رمز عبور؛ نسخه کش شده
+    get_user_by_conversation برای مسیر چت. None اگر گفتگو وجود نداشته باشد.
+    """
+    user_id = _conversation_owners.get(conversation_id)
+    profile = _profiles.get(user_id) if user_id is not None else None
+    if profile is not None: return profile
+    row = get_user_by_conversation(conversation_id)
+    if row is None: return None
+    profile = {key: row[key] for key in row.keys() if key != "hashed_password"}
+    _conversation_owners.put(conversation_id, profile["id"])
+    _profiles.put(profile["id"], profile)
+    return profile
+
+def update_user_profile(user_id: int, experience: int, subject: str, field: str) -> bool:
+    with get_connection() as conn:
+        cursor = conn.execute("UPDATE users SET experience = ?, subject = ?, field = ? WHERE id = ?", (experience, subject, field, user_id))
+    _profiles.pop(user_id)
+    return cursor.rowcount > 0
 
 def delete_conversation(conversation_id: str, user_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM conversations WHERE id = ? AND user_id = ?", (conversation_id, user_id))
-    if cursor.fetchone():
-        cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
-        conn.commit(); conn.close(); return True
-    conn.close(); return False
+    with get_connection() as conn:
+        cursor = conn.execute("DELETE FROM conversations WHERE id = ? AND user_id = ?", (conversation_id, user_id))
+        if cursor.rowcount: conn.execute("DELETE FROM conversation_summaries WHERE conversation_id = ?", (conversation_id,))
+    _conversation_owners.pop(conversation_id)
+    return cursor.rowcount > 0
 
 def add_message(conversation_id, role, content):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)", (conversation_id, role, content))
-    message_id = cursor.lastrowid
-    conn.commit(); conn.close()
-    return message_id
-
-def get_messages(conversation_id: str, page: int = 1, limit: int = 20):
-    offset = (page - 1) * limit
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    # خواندن پیام‌ها به همراه شناسه منحصر به فردشان
-    cursor.execute(
-        "SELECT id, role, content FROM messages WHERE conversation_id = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?",
-        (conversation_id, limit, offset)
-    )
+    with get_connection() as conn:
+        cursor = conn.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)", (conversation_id, role, content))
+    return cursor.lastrowid
+
+def get_messages(conversation_id: str, limit: int = 20, before_id: int = None, after_id: int = None):
+    """
+    صفحه‌بندی بر اساس شناسه پیام (keyset): بدون پارامتر، آخرین پیام‌ها؛ با before_id پیام‌های قدیمی‌تر
+    و با after_id پیام‌های جدیدتر از آن شناسه. هزینه به طول گفتگو بستگی ندارد و ترتیب همیشه قطعی است.
+    خروجی همیشه از قدیم به جدید مرتب است. before_id و after_id با هم پذیرفته نمی‌شوند (ValueError).
+    """
+    if before_id is not None and after_id is not None:
+        raise ValueError("before_id و after_id را نمی‌توان با هم استفاده کرد")
+    if after_id is not None:
+        cursor = get_connection().execute(
+            "SELECT id, role, content FROM messages WHERE conversation_id = ? AND id > ? ORDER BY id ASC LIMIT ?",
+            (conversation_id, after_id, limit))
+        return [{"id": row[0], "role": row[1], "content": row[2]} for row in cursor.fetchall()]
+    cursor = get_connection().execute(
+        "SELECT id, role, content FROM messages WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+        (conversation_id, before_id if before_id is not None else 2**63 - 1, limit))
     #  پیام‌ها به صورت معکوس (جدید به قدیم) خوانده می‌شوند
     messages = [{"id": row[0], "role": row[1], "content": row[2]} for row in cursor.fetchall()]
-    conn.close()
     return messages[::-1] # لیست را برمی‌گردانیم تا ترتیب درست شود (قدیم به جدید)
 
+def get_recent_messages(conversation_id: str, n: int, before_id: int = None):
+    """آخرین n پیام گفتگو (پیش از before_id) به ترتیب زمانی، برای ساخت تاریخچه مسیر چت."""
+    return get_messages(conversation_id, limit=n, before_id=before_id)
+
+def get_conversation_summary(conversation_id: str):
+    """خلاصه ذخیره‌شده گفتگو و شناسه آخرین پیام پوشش داده شده را برمی‌گرداند؛ ("", 0) اگر وجود نداشته باشد."""
+    row = get_connection().execute(
+        "SELECT summary, last_message_id FROM conversation_summaries WHERE conversation_id = ?", (conversation_id,)).fetchone()
+    return (row[0], row[1]) if row else ("", 0)
+
+def save_conversation_summary(conversation_id: str, summary: str, last_message_id: int):
+    with get_connection() as conn:
+        conn.execute("""INSERT INTO conversation_summaries (conversation_id, summary, last_message_id) VALUES (?, ?, ?)
+                        ON CONFLICT(conversation_id) DO UPDATE SET summary = excluded.summary,
+                        last_message_id = excluded.last_message_id, updated_at = CURRENT_TIMESTAMP""",
+                     (conversation_id, summary, last_message_id))
+
 def add_feedback(message_id, user_id, rating):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    # برای جلوگیری از ثبت بازخورد تکراری 
-    cursor.execute("DELETE FROM feedback WHERE message_id = ? AND user_id = ?", (message_id, user_id))
-    cursor.execute("INSERT INTO feedback (message_id, user_id, rating) VALUES (?, ?, ?)", (message_id, user_id, rating))
-    conn.commit(); conn.close()
\ No newline at end of file
+    with get_connection() as conn:
+        # برای جلوگیری از ثبت بازخورد تکراری
+        conn.execute("DELETE FROM feedback WHERE message_id = ? AND user_id = ?", (message_id, user_id))
+        conn.execute("INSERT INTO feedback (message_id, user_id, rating) VALUES (?, ?, ?)", (message_id, user_id, rating))
+
+# --- نسخه‌های async برای مسیرهای FastAPI (بدون مسدود کردن حلقه رویداد) ---
+def _to_async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    return wrapper
+
+aget_user = _to_async(get_user)
+acreate_user = _to_async(create_user)
+acreate_conversation = _to_async(create_conversation)
+aget_user_conversations = _to_async(get_user_conversations)
+aget_user_by_conversation = _to_async(get_user_by_conversation)
+aget_profile_by_conversation = _to_async(get_profile_by_conversation)
+aupdate_user_profile = _to_async(update_user_profile)
+adelete_conversation = _to_async(delete_conversation)
+aadd_message = _to_async(add_message)
+aget_messages = _to_async(get_messages)
+aget_recent_messages = _to_async(get_recent_messages)
+aadd_feedback = _to_async(add_feedback)
+aget_conversation_summary = _to_async(get_conversation_summary)
+asave_conversation_summary = _to_async(save_conversation_summary)
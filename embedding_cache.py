@@ -0,0 +1,143 @@
+# embedding_cache.py - کش ماندگار embedding با کلید (ارائه‌دهنده، مدل، هش متن)
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    کش دو لایه: یک LRU درون پردازه جلوی یک جدول SQLite مشترک بین پردازه‌ها.
+    جدول با حذف قدیمی‌ترین ردیف‌ها (بر اساس آخرین استفاده) به max_entries محدود می‌شود.
+    """
+    def __init__(self, path: str, max_entries: int = 200_000, memory_entries: int = 4096):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = self.misses = self.memory_hits = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            text_hash BLOB NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (provider, model, text_hash)
+        ) WITHOUT ROWID""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def _remember(self, key, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_entries: self._memory.popitem(last=False)
+
+    def get_memory(self, provider: str, model: str, text: str):
+        """
+        فقط LRU درون پردازه را نگاه می‌کند و هرگز منتظر قفل یا SQLite نمی‌ماند (مناسب حلقه رویداد).
+        None یعنی باید get_many (ترجیحاً در یک نخ جدا) فراخوانی شود.
+        """
+        if not self._lock.acquire(blocking=False): return None
+        try:
+            key = (provider, model, self.text_hash(text))
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1; self.memory_hits += 1
+            return vector
+        finally:
+            self._lock.release()
+
+    def get_many(self, provider: str, model: str, texts: list[str]) -> list:
+        """برای هر متن بردار ذخیره‌شده یا None برمی‌گرداند."""
+        hashes = [self.text_hash(t) for t in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            for i, h in enumerate(hashes):
+                vector = self._memory.get((provider, model, h))
+                if vector is not None:
+                    self._memory.move_to_end((provider, model, h))
+                    results[i] = vector; self.memory_hits += 1
+                else:
+                    missing.setdefault(h, []).append(i)
+            found = []
+            keys = list(missing)
+            # SQLite در هر پرسش حداکثر ۹۹۹ پارامتر می‌پذیرد
+            for start in range(0, len(keys), 900):
+                part = keys[start:start + 900]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE provider = ? AND model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                    (provider, model, *part)).fetchall()
+                for h, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember((provider, model, h), vector)
+                    for i in missing[h]: results[i] = vector
+                    found.append(h)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE provider = ? AND model = ? AND text_hash = ?",
+                                       [(now, provider, model, h) for h in found])
+                self._conn.commit()
+            hit_count = sum(r is not None for r in results)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+        return results
+
+    def put_many(self, provider: str, model: str, texts: list[str], vectors):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                vector = np.ascontiguousarray(vector, dtype=np.float32)
+                h = self.text_hash(text)
+                self._remember((provider, model, h), vector)
+                rows.append((provider, model, h, vector.tobytes(), now))
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._size += len(rows)
+            if self._size > self.max_entries:
+                # حذف ۱۰٪ بیشتر از حد لازم تا حذف در هر درج تکرار نشود
+                self._conn.execute("DELETE FROM embeddings WHERE (provider, model, text_hash) IN "
+                                   "(SELECT provider, model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+                                   (self._size - int(self.max_entries * 0.9),))
+                self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "memory_hits": self.memory_hits,
+                "hit_rate": self.hits / total if total else 0.0, "entries": self._size}
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    کش مشترک را بر اساس EMBEDDING_CACHE_PATH (پیش‌فرض embedding_cache.db) برمی‌گرداند.
+    مقدار خالی برای این متغیر کش را غیرفعال می‌کند.
+    """
+    global _default_cache
+    path = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+    if not path: return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                path,
+                max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")),
+                memory_entries=int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "4096")))
+        return _default_cache
@@ -1,75 +1,328 @@
-# ingest.py - نسخه نهایی با ساخت ایندکس FAISS و BM25
+# ingest.py - خط لوله افزایشی، موازی و جریانی ساخت ایندکس FAISS و BM25
 import os
-import pickle
+import json
+import hashlib
+from bisect import bisect_right
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 import numpy as np
-import faiss
-from rank_bm25 import BM25Okapi
+from dotenv import load_dotenv
+
+load_dotenv()  # پیش از import ماژول‌های محلی که تنظیمات (مثل KB_DIR) را هنگام import می‌خوانند
+from bm25_index import BM25Index
+import vector_index
+import knowledge_base
+import persian_text
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from pypdf import PdfReader
-from dotenv import load_dotenv
 from llm_providers import get_llm_provider
 
+KNOWLEDGE_BASE_DIR = "knowledge_base"
+MANIFEST_PATH = "ingest_manifest.json"
+CHUNK_SIZE, CHUNK_OVERLAP = 1000, 100
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "8"))
+
+
+def _sha256(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest() -> dict:
+    """
+    مانیفست برای هر فایل PDF هش کل فایل، هش هر صفحه و فهرست تکه‌ها (شناسه + هش + صفحه) را نگه می‌دارد؛
+    تنظیمات ساخت ایندکس (index_settings) هم در کلید settings ثبت می‌شود. نبود مانیفست یعنی ساخت کامل از ابتدا.
+    """
+    if not os.path.exists(MANIFEST_PATH): return {"next_id": 0, "files": {}}
+    with open(MANIFEST_PATH, encoding="utf-8") as f: return json.load(f)
+
+
+def save_manifest(manifest: dict):
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def index_settings(llm_provider) -> dict:
+    """
+    تنظیماتی که ایندکس به آن‌ها وابسته است. تغییر embedding یا تقسیم‌بندی یعنی ساخت کامل از ابتدا؛
+    تغییر فقط نوع یا پارامترهای ایندکس FAISS (کلید index) یعنی بازسازی ایندکس برداری از همان تکه‌ها.
+    ابعاد embedding با یک پرسش نمونه تعیین می‌شود که پس از اولین اجرا از کش embedding خوانده می‌شود.
+    """
+    return {**llm_provider.embedding_signature(), "dim": len(llm_provider.create_embedding("dimension probe")),
+            "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "index": vector_index.build_settings()}
+
+
+def _without_index(settings: dict) -> dict:
+    return {k: v for k, v in (settings or {}).items() if k != "index"}
+
+
+# --- مرحله ۱: استخراج (در پردازه‌های جداگانه، به تفکیک بازه صفحه) و تقسیم ---
+def extract_pages(path: str, start: int, stop: int) -> list[str]:
+    """متن صفحات [start, stop) یک PDF؛ هر بازه یک کار مستقل ProcessPool است."""
+    pages = PdfReader(path).pages
+    return [pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def split_pages(file_hash: str, pages: list[str], known_pages: list = None) -> dict:
+    """
+    متن صفحات یک PDF را به تکه تقسیم می‌کند. تکه‌ها از مرز سند عبور نمی‌کنند و شماره صفحه شروع هر تکه
+    حفظ می‌شود. اگر متن صفحات تغییری نکرده باشد، تقسیم انجام نمی‌شود.
+    """
+    page_hashes = [_sha256(p) for p in pages]
+    if page_hashes == known_pages: return {"sha256": file_hash, "status": "same_text"}
+
+    page_starts, offset = [], 0
+    for text in pages:
+        page_starts.append(offset); offset += len(text) + 1
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True)
+    chunks = [(doc.page_content, bisect_right(page_starts, doc.metadata["start_index"]))
+              for doc in text_splitter.create_documents(["\n".join(pages)])]
+    return {"sha256": file_hash, "status": "changed", "pages": page_hashes, "chunks": chunks}
+
+
+def iter_page_ranges(filenames: list[str], manifest: dict, files: dict, ready: deque):
+    """
+    بازه‌های صفحه فایل‌های تغییرکرده را به صورت (نام فایل، شروع، پایان) تولید و وضعیت هر فایل را در files ثبت می‌کند.
+    فایل‌هایی که هش آن‌ها تغییر نکرده بدون ارسال به استخر مستقیم به ready اضافه می‌شوند.
+    """
+    for filename in filenames:
+        path = os.path.join(KNOWLEDGE_BASE_DIR, filename)
+        try:
+            file_hash = file_sha256(path)
+            if file_hash == (manifest["files"].get(filename) or {}).get("sha256"):
+                ready.append((filename, {"sha256": file_hash, "status": "unchanged"})); continue
+            page_count = len(PdfReader(path).pages)
+        except Exception as e:
+            print(f"  - ⚠️ خطا در خواندن فایل {filename}: {e}"); continue
+        if not page_count:
+            ready.append((filename, split_pages(file_hash, [], (manifest["files"].get(filename) or {}).get("pages")))); continue
+        files[filename] = {"sha256": file_hash, "pages": [None] * page_count, "remaining": -(-page_count // PAGES_PER_TASK)}
+        for start in range(0, page_count, PAGES_PER_TASK):
+            yield filename, path, start, min(page_count, start + PAGES_PER_TASK)
+
+
+def iter_processed_files(filenames: list[str], manifest: dict, workers: int):
+    """
+    استخراج متن در یک ProcessPool به صورت بازه‌های PAGES_PER_TASK صفحه‌ای انجام می‌شود تا یک PDF بزرگ هم
+    روی همه هسته‌ها پخش شود. وقتی همه بازه‌های یک فایل رسید، تقسیم آن هم به استخر سپرده می‌شود و نتیجه
+    به ترتیب اتمام برمی‌گردد. حداکثر 2 * workers کار هم‌زمان در جریان است تا حافظه با بزرگ شدن مجموعه ثابت بماند.
+    """
+    files, ready = {}, deque()
+    ranges = iter_page_ranges(filenames, manifest, files, ready)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}  # future -> (نام فایل، شروع بازه یا None برای کار تقسیم)
+
+        def submit_split(filename: str):
+            state = files.pop(filename)
+            known_pages = (manifest["files"].get(filename) or {}).get("pages")
+            pending[pool.submit(split_pages, state["sha256"], state["pages"], known_pages)] = (filename, None)
+
+        def submit_next():
+            item = next(ranges, None)
+            if item is None: return
+            filename, path, start, stop = item
+            pending[pool.submit(extract_pages, path, start, stop)] = (filename, start)
+
+        for _ in range(2 * workers): submit_next()
+        while pending or ready:
+            while ready: yield ready.popleft()
+            if not pending: break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename, start = pending.pop(future)
+                submit_next()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # خطای یک بازه کل فایل را کنار می‌گذارد؛ بازه‌های دیگر همان فایل نادیده گرفته می‌شوند
+                    if start is None or files.pop(filename, None) is not None:
+                        print(f"  - ⚠️ خطا در خواندن فایل {filename}: {e}")
+                    continue
+                if start is None:
+                    ready.append((filename, result))
+                elif filename in files:
+                    state = files[filename]
+                    state["pages"][start:start + len(result)] = result
+                    state["remaining"] -= 1
+                    if not state["remaining"]: submit_split(filename)
+
+
+def iter_new_chunks(manifest: dict, removed_ids: list, workers: int):
+    """
+    فایل‌های knowledge_base را با مانیفست مقایسه و مانیفست را درجا به‌روز می‌کند.
+    تکه‌های جدید به صورت (شناسه، رکورد) تولید می‌شوند و شناسه تکه‌های حذف‌شده به removed_ids اضافه می‌شود.
+    """
+    pdf_files = sorted(f for f in os.listdir(KNOWLEDGE_BASE_DIR) if f.endswith(".pdf"))
+    for filename in set(manifest["files"]) - set(pdf_files):
+        print(f"  - 🗑️ فایل حذف‌شده: {filename}")
+        removed_ids += [c["id"] for c in manifest["files"].pop(filename)["chunks"]]
+
+    for filename, result in iter_processed_files(pdf_files, manifest, workers):
+        entry = manifest["files"].get(filename)
+        if result["status"] != "changed":
+            # در حالت same_text فقط فراداده فایل تغییر کرده است
+            entry["sha256"] = result["sha256"]; continue
+
+        # تکه‌های قبلی این فایل بر اساس هش متن دوباره استفاده می‌شوند
+        previous = defaultdict(list)
+        for c in (entry or {}).get("chunks", []): previous[c["sha256"]].append(c["id"])
+        chunk_entries = []
+        for text, page in result["chunks"]:
+            chunk_hash = _sha256(text)
+            if previous[chunk_hash]:
+                chunk_id = previous[chunk_hash].pop()
+            else:
+                chunk_id = manifest["next_id"]; manifest["next_id"] += 1
+                yield chunk_id, {"text": text, "source": filename, "page": page}
+            chunk_entries.append({"id": chunk_id, "sha256": chunk_hash, "page": page})
+        removed_ids += [chunk_id for ids in previous.values() for chunk_id in ids]
+        manifest["files"][filename] = {"sha256": result["sha256"], "pages": result["pages"], "chunks": chunk_entries}
+        print(f"  - 📄 {filename}: {len(result['pages'])} صفحه، {len(chunk_entries)} تکه")
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)): yield batch
+
+
 def main():
     print("--- شروع اسکریپت پردازش دانش (ingest.py) با FAISS و BM25 ---")
-    load_dotenv()
+
+    if not os.path.exists(KNOWLEDGE_BASE_DIR) or not os.listdir(KNOWLEDGE_BASE_DIR):
+        print(f"❌ خطا: پوشه '{KNOWLEDGE_BASE_DIR}' خالی است."); return
+    workers = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+    batch_size = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+    # ایندکس‌های IVF پیش از افزودن بردارها به نمونه آموزشی نیاز دارند
+    train_size = int(os.getenv("INGEST_TRAIN_SIZE", "20000"))
 
     try:
         llm_provider = get_llm_provider()
-    except (ValueError, ConnectionError) as e:
+        settings = index_settings(llm_provider)
+    except Exception as e:
         print(f"❌ خطا در مقداردهی اولیه ارائه‌دهنده: {e}"); return
 
-    KNOWLEDGE_BASE_DIR = "knowledge_base"
-    
-    # ... (بخش خواندن و تقسیم کردن PDF بدون تغییر) ...
-    documents = []
-    print(f"\nدر حال جستجو برای فایل‌های PDF در پوشه '{KNOWLEDGE_BASE_DIR}'...")
-    if not os.path.exists(KNOWLEDGE_BASE_DIR) or not os.listdir(KNOWLEDGE_BASE_DIR):
-        print(f"❌ خطا: پوشه '{KNOWLEDGE_BASE_DIR}' خالی است."); return
-    for filename in os.listdir(KNOWLEDGE_BASE_DIR):
-        if filename.endswith(".pdf"):
-            try:
-                reader = PdfReader(os.path.join(KNOWLEDGE_BASE_DIR, filename))
-                for page in reader.pages:
-                    text = page.extract_text()
-                    if text: documents.append(text)
-            except Exception as e:
-                print(f"  - ⚠️ خطا در خواندن فایل {filename}: {e}")
-    if not documents: print("❌ خطا: هیچ متنی از فایل‌های PDF استخراج نشد."); return
-    print(f"✅ {len(documents)} صفحه با موفقیت خوانده شد.")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    chunks = text_splitter.split_text(" ".join(documents))
-    print(f"✅ اسناد به {len(chunks)} تکه تقسیم شدند.")
-
-    # --- ساخت ایندکس کلیدواژه‌ای BM25 ---
-    print("\nدر حال ساخت ایندکس کلیدواژه‌ای BM25...")
+    manifest = load_manifest()
+    previous = manifest.get("settings") or {}
+    if manifest["files"] and _without_index(previous) != _without_index(settings):
+        # بردارهای قبلی در فضای embedding دیگری هستند و با پرسش‌ها و بردارهای جدید قابل مقایسه نیستند
+        print(f"♻️ تنظیمات ایندکس تغییر کرده است ({_without_index(previous)} ← {_without_index(settings)})؛ ساخت کامل انجام می‌شود.")
+        manifest = {"next_id": 0, "files": {}}
+    index, chunks, bm25_index = None, knowledge_base.ChunkUpdates(), None
+    if manifest["files"]:
+        try:
+            # نسخه فعلی بدون mmap بارگذاری می‌شود چون ایندکس‌ها درجا تغییر می‌کنند
+            kb = knowledge_base.load_current(mmap=False)
+            index, bm25_index = kb.index, kb.bm25
+            # متن تکه‌های قبلی از نسخه map شده خوانده می‌شود؛ فقط تکه‌های جدید در حافظه می‌مانند
+            chunks = knowledge_base.ChunkUpdates(kb.chunks)
+            # حذف باقیمانده یک اجرای نیمه‌کاره (شناسه‌هایی که در مانیفست ثبت نشده‌اند)
+            next_id = manifest["next_id"]
+            index = vector_index.remove_id_range(index, next_id)
+            for chunk_id in [c for c in chunks if c >= next_id]: chunks.discard(chunk_id)
+            leftover = bm25_index.doc_ids[bm25_index.doc_ids >= next_id]
+            if len(leftover): bm25_index = bm25_index.update(leftover)
+        except Exception as e:
+            print(f"⚠️ ایندکس‌های قبلی قابل بارگذاری نیستند ({e})؛ ساخت کامل انجام می‌شود.")
+            manifest, index, chunks, bm25_index = {"next_id": 0, "files": {}}, None, knowledge_base.ChunkUpdates(), None
+    # نوع یا پارامترهای ایندکس FAISS عوض شده اما تکه‌ها و embeddingها همان‌اند: فقط ایندکس برداری بازسازی می‌شود
+    rebuild_vectors = index is not None and previous.get("index") != settings["index"]
+    manifest["settings"] = settings
+
+    removed_ids, new_ids, pending_vectors, pending_ids = [], [], [], []
+    if rebuild_vectors:
+        print(f"♻️ ایندکس FAISS تغییر کرده است ({previous.get('index')} ← {settings['index']})؛ "
+              f"ایندکس برداری از embeddingهای تکه‌های موجود (از کش embedding) بازسازی می‌شود.")
+        index = None
+        try:
+            for batch_ids in batched(list(chunks), batch_size):
+                embeddings = llm_provider.create_document_embeddings([chunks[i]["text"] for i in batch_ids])
+                if index is None:
+                    pending_vectors.append(np.asarray(embeddings, dtype=np.float32)); pending_ids += batch_ids
+                    if len(pending_ids) >= train_size:
+                        index = vector_index.build_index(np.vstack(pending_vectors), ids=pending_ids)
+                        pending_vectors, pending_ids = [], []
+                else:
+                    index = vector_index.add_vectors(index, embeddings, batch_ids)
+        except Exception as e:
+            print(f"❌ خطا در بازسازی embeddingها: {e}"); return
+
+    print(f"\nدر حال مقایسه فایل‌های PDF پوشه '{KNOWLEDGE_BASE_DIR}' با مانیفست ({workers} پردازه)...")
     try:
-        tokenized_chunks = [doc.split(" ") for doc in chunks]
-        bm25_index = BM25Okapi(tokenized_chunks)
-        with open("bm25_index.pkl", "wb") as f:
-            pickle.dump(bm25_index, f)
-        print("✅ ایندکس BM25 با موفقیت در فایل bm25_index.pkl ذخیره شد.")
+        # --- مرحله ۲: ساخت embedding در دسته‌های محدود، هم‌زمان با استخراج ---
+        for batch in batched(iter_new_chunks(manifest, removed_ids, workers), batch_size):
+            batch_ids = [chunk_id for chunk_id, _ in batch]
+            embeddings = llm_provider.create_document_embeddings([record["text"] for _, record in batch])
+            chunks.update(batch)
+            new_ids += batch_ids
+            if index is None:
+                pending_vectors.append(np.asarray(embeddings, dtype=np.float32)); pending_ids += batch_ids
+                if len(pending_ids) >= train_size:
+                    index = vector_index.build_index(np.vstack(pending_vectors), ids=pending_ids)
+                    pending_vectors, pending_ids = [], []
+            else:
+                index = vector_index.add_vectors(index, embeddings, batch_ids)
+            print(f"  - ✅ embedding {len(new_ids)} تکه ساخته شد.")
     except Exception as e:
-        print(f"❌ خطا در ساخت ایندکس BM25: {e}"); return
-        
-    # --- ساخت ایندکس برداری FAISS ---
-    print("\nدر حال ساخت embedding برای تکه‌ها...")
+        print(f"❌ خطا در ساخت embedding: {e}"); return
+
+    if llm_provider._get_cache() is not None:
+        stats = llm_provider._get_cache().stats()
+        print(f"✅ کش embedding: {stats['hits']} برخورد، {stats['misses']} عدم برخورد ({stats['entries']} ردیف)")
+
+    # ایندکسی که با توکن‌ساز دیگری ساخته شده با پرسش‌ها سازگار نیست و باید کامل ساخته شود
+    tokenizer = persian_text.tokenizer_version()
+    rebuild_bm25 = bm25_index is not None and bm25_index.tokenizer != tokenizer
+    if not removed_ids and not new_ids and not rebuild_bm25 and not rebuild_vectors:
+        save_manifest(manifest)
+        print("✅ پایگاه دانش به‌روز است؛ نیازی به ساخت embedding نیست."); return
+    print(f"✅ {len(new_ids)} تکه جدید و {len(removed_ids)} تکه حذف‌شده پردازش شد.")
+
+    # --- مرحله ۳: به‌روزرسانی ایندکس برداری FAISS ---
+    print("\nدر حال به‌روزرسانی پایگاه داده FAISS...")
     try:
-        embeddings = llm_provider.create_document_embeddings(chunks)
-        print("✅ Embedding با موفقیت ساخته شد.")
+        if index is None:
+            index = vector_index.build_index(np.vstack(pending_vectors), ids=pending_ids)
+        index = vector_index.remove_vectors(index, removed_ids)
+        for chunk_id in removed_ids: chunks.discard(chunk_id)
+        print(f"✅ ایندکس {vector_index.describe(index)} به‌روز شد.")
     except Exception as e:
-        print(f"❌ خطا در ساخت embedding: {e}"); return
-        
-    print("\nدر حال ساخت و ذخیره‌سازی پایگاه داده FAISS...")
+        print(f"❌ خطا در ساخت FAISS: {e}"); return
+
+    # --- مرحله ۴: به‌روزرسانی ایندکس کلیدواژه‌ای BM25 ---
+    print("\nدر حال به‌روزرسانی ایندکس کلیدواژه‌ای BM25...")
+    try:
+        if rebuild_bm25:
+            print(f"  - ♻️ توکن‌ساز تغییر کرده است ({bm25_index.tokenizer} ← {tokenizer})؛ ایندکس BM25 از نو ساخته می‌شود.")
+            bm25_index = None
+        if bm25_index is None:
+            all_ids = list(chunks)
+            bm25_index = BM25Index.build((persian_text.tokenize(chunks[i]["text"]) for i in all_ids), doc_ids=all_ids, tokenizer=tokenizer)
+        else:
+            tokenized = (persian_text.tokenize(chunks[chunk_id]["text"]) for chunk_id in new_ids)
+            bm25_index = bm25_index.update(removed_ids, tokenized, new_ids)
+        print(f"✅ ایندکس BM25 ({len(bm25_index.vocab)} واژه، {bm25_index.n_docs} سند) به‌روز شد.")
+    except Exception as e:
+        print(f"❌ خطا در ساخت ایندکس BM25: {e}"); return
+
+    # --- مرحله ۵: انتشار نسخه جدید پایگاه دانش (سرورها با CURRENT آن را بارگذاری می‌کنند) ---
     try:
-        embeddings_np = np.array(embeddings).astype('float32')
-        index = faiss.IndexFlatL2(embeddings_np.shape[1])
-        index.add(embeddings_np)
-        faiss.write_index(index, "faiss_index.bin")
-        with open("chunks.pkl", "wb") as f:
-            pickle.dump(chunks, f)
-        print("✅ پایگاه داده FAISS با موفقیت ذخیره شد.")
+        version = knowledge_base.publish_version(index, chunks, bm25_index)
+        print(f"✅ نسخه {version} پایگاه دانش در پوشه {knowledge_base.KB_DIR} منتشر شد.")
     except Exception as e:
-        print(f"❌ خطا در ساخت یا ذخیره‌سازی FAISS: {e}")
+        print(f"❌ خطا در ذخیره‌سازی پایگاه دانش: {e}"); return
+
+    # مانیفست آخر از همه ذخیره می‌شود تا اجرای نیمه‌کاره در دفعه بعد تکرار شود
+    save_manifest(manifest)
+    print("✅ مانیفست پردازش دانش به‌روز شد.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
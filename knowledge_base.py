@@ -0,0 +1,220 @@
+# knowledge_base.py - پایگاه دانش نسخه‌دار روی دیسک (kb/versions/<نسخه>/ + اشاره‌گر CURRENT)
+import os
+import json
+import time
+import shutil
+import pickle
+from dataclasses import dataclass
+import numpy as np
+import faiss
+from bm25_index import BM25Index
+import vector_index
+
+KB_DIR = os.getenv("KB_DIR", "kb")
+# فایل‌های قالب قدیمی (پیش از پوشه‌های نسخه‌دار)
+LEGACY_FAISS_PATH, LEGACY_CHUNKS_PATH, LEGACY_BM25_PATH = "faiss_index.bin", "chunks.pkl", "bm25_index"
+
+
+class ChunkStore:
+    """
+    متن تکه‌ها در یک فایل پیوسته (chunks.bin) و آفست هر تکه در آرایه‌های numpy ذخیره می‌شود.
+    همه فایل‌ها به صورت mmap باز می‌شوند، پس workerهای مختلف یک نسخه مشترک از صفحات را در page cache می‌بینند.
+    خواندن یک تکه: chunk_id -> سطر (جستجوی دودویی) -> برش بایت‌ها و decode.
+    """
+    def __init__(self, path: str, mmap: bool = True):
+        mode = "r" if mmap else None
+        self.ids = np.load(os.path.join(path, "chunk_ids.npy"), mmap_mode=mode)
+        self.offsets = np.load(os.path.join(path, "chunk_offsets.npy"), mmap_mode=mode)
+        self.pages = np.load(os.path.join(path, "chunk_pages.npy"), mmap_mode=mode)
+        self.source_index = np.load(os.path.join(path, "chunk_sources.npy"), mmap_mode=mode)
+        with open(os.path.join(path, "sources.json"), encoding="utf-8") as f: self.sources = json.load(f)
+        blob_path = os.path.join(path, "chunks.bin")
+        if os.path.getsize(blob_path) == 0:
+            self.blob = np.empty(0, dtype=np.uint8)
+        elif mmap:
+            self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self.blob = np.fromfile(blob_path, dtype=np.uint8)
+
+    @staticmethod
+    def write(path: str, chunks):
+        """chunks: نگاشت شناسه به رکورد {"text", "source", "page"} (dict یا ChunkUpdates خروجی ingest)."""
+        ids = np.array(sorted(chunks), dtype=np.int64)
+        sources, source_rows = [], {}
+        offsets, pages, source_index = [0], [], []
+        with open(os.path.join(path, "chunks.bin"), "wb") as f:
+            for chunk_id in ids:
+                record = chunks[int(chunk_id)]
+                data = record["text"].encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+                pages.append(record["page"])
+                source_index.append(source_rows.setdefault(record["source"], len(source_rows)))
+        sources = list(source_rows)
+        np.save(os.path.join(path, "chunk_ids.npy"), ids)
+        np.save(os.path.join(path, "chunk_offsets.npy"), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(path, "chunk_pages.npy"), np.array(pages, dtype=np.int32))
+        np.save(os.path.join(path, "chunk_sources.npy"), np.array(source_index, dtype=np.int32))
+        with open(os.path.join(path, "sources.json"), "w", encoding="utf-8") as f: json.dump(sources, f, ensure_ascii=False)
+
+    def _row(self, chunk_id: int) -> int:
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row >= len(self.ids) or self.ids[row] != chunk_id: raise KeyError(chunk_id)
+        return row
+
+    def __getitem__(self, chunk_id: int) -> dict:
+        row = self._row(chunk_id)
+        text = self.blob[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+        return {"text": text, "source": self.sources[self.source_index[row]], "page": int(self.pages[row])}
+
+    def __contains__(self, chunk_id) -> bool:
+        try:
+            self._row(chunk_id); return True
+        except KeyError:
+            return False
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return (int(chunk_id) for chunk_id in self.ids)
+
+
+class ChunkUpdates:
+    """
+    تکه‌های نسخه فعلی (ChunkStore یا dict قالب قدیمی) به همراه تکه‌های افزوده و حذف‌شده در ingest افزایشی.
+    فقط تکه‌های جدید در حافظه نگه داشته می‌شوند؛ متن بقیه هنگام نوشتن نسخه بعد از فایل map شده خوانده می‌شود.
+    """
+    def __init__(self, base=None):
+        self.base = base if base is not None else {}
+        self.added, self.removed = {}, set()
+
+    def update(self, items):
+        self.added.update(items)
+
+    def discard(self, chunk_id: int):
+        if self.added.pop(chunk_id, None) is None and chunk_id in self.base: self.removed.add(chunk_id)
+
+    def __getitem__(self, chunk_id: int) -> dict:
+        if chunk_id in self.added: return self.added[chunk_id]
+        if chunk_id in self.removed: raise KeyError(chunk_id)
+        return self.base[chunk_id]
+
+    def __contains__(self, chunk_id) -> bool:
+        return chunk_id in self.added or (chunk_id not in self.removed and chunk_id in self.base)
+
+    def __iter__(self):
+        yield from (chunk_id for chunk_id in self.base if chunk_id not in self.removed)
+        yield from self.added
+
+    def __len__(self) -> int:
+        return len(self.base) - len(self.removed) + len(self.added)
+
+
+@dataclass
+class KnowledgeBase:
+    version: str
+    index: object
+    chunks: object
+    bm25: BM25Index
+    load_ms: float = 0.0
+
+
+def _current_path(kb_dir: str) -> str:
+    return os.path.join(kb_dir, "CURRENT")
+
+
+def current_version(kb_dir: str = KB_DIR) -> str | None:
+    try:
+        with open(_current_path(kb_dir), encoding="utf-8") as f: return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_faiss_index(path: str, mmap: bool = True):
+    """
+    ایندکس را در صورت امکان به صورت mmap و فقط‌خواندنی باز می‌کند تا بردارها در حافظه هر worker کپی نشوند.
+    IO_FLAG_MMAP_IFC (faiss >= 1.8) کدهای ایندکس‌های تخت و HNSW را هم map می‌کند؛ IO_FLAG_MMAP فقط لیست‌های IVF را.
+    """
+    if mmap:
+        for flag in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+            if not hasattr(faiss, flag): continue
+            try:
+                return faiss.read_index(path, getattr(faiss, flag) | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                continue
+    return faiss.read_index(path)
+
+
+def load_version(version: str, kb_dir: str = KB_DIR, mmap: bool = True) -> KnowledgeBase:
+    start = time.perf_counter()
+    path = os.path.join(kb_dir, "versions", version)
+    index = read_faiss_index(os.path.join(path, "faiss.index"), mmap)
+    if mmap: index = vector_index.configure_search(index)
+    # تکه‌ها هیچ‌گاه درجا تغییر نمی‌کنند، پس حتی با mmap=False (ingest) متن آن‌ها در حافظه بار نمی‌شود
+    chunks = ChunkStore(path)
+    bm25 = BM25Index.load(os.path.join(path, "bm25"), mmap=mmap)
+    return KnowledgeBase(version, index, chunks, bm25, (time.perf_counter() - start) * 1000)
+
+
+def load_legacy(mmap: bool = True) -> KnowledgeBase:
+    """فایل‌های قالب قدیمی (faiss_index.bin، chunks.pkl و bm25_index/ یا bm25_index.pkl) در ریشه پروژه."""
+    start = time.perf_counter()
+    index = faiss.read_index(LEGACY_FAISS_PATH)
+    if mmap: index = vector_index.configure_search(index)
+    with open(LEGACY_CHUNKS_PATH, "rb") as f: chunks = pickle.load(f)
+    if os.path.isdir(LEGACY_BM25_PATH):
+        bm25 = BM25Index.load(LEGACY_BM25_PATH, mmap=mmap)
+    else:
+        with open(LEGACY_BM25_PATH + ".pkl", "rb") as f: bm25 = BM25Index.from_okapi(pickle.load(f))
+    return KnowledgeBase("legacy", index, chunks, bm25, (time.perf_counter() - start) * 1000)
+
+
+def load_current(kb_dir: str = KB_DIR, mmap: bool = True) -> KnowledgeBase | None:
+    """نسخه‌ای که CURRENT به آن اشاره می‌کند؛ در نبود آن فایل‌های قالب قدیمی و در نبود آن‌ها None."""
+    version = current_version(kb_dir)
+    if version is not None: return load_version(version, kb_dir, mmap)
+    if os.path.exists(LEGACY_FAISS_PATH) and os.path.exists(LEGACY_CHUNKS_PATH): return load_legacy(mmap)
+    return None
+
+
+def publish_version(index, chunks, bm25: BM25Index, kb_dir: str = KB_DIR, keep: int = None) -> str:
+    """
+    نسخه جدید را در یک پوشه موقت می‌نویسد، با rename نهایی می‌کند و سپس CURRENT را به صورت اتمی جایگزین می‌کند.
+    workerهایی که هنوز نسخه قبلی را map کرده‌اند تحت تأثیر قرار نمی‌گیرند. فقط keep نسخه آخر (KB_KEEP_VERSIONS) نگه داشته می‌شود.
+    """
+    keep = keep or int(os.getenv("KB_KEEP_VERSIONS", "3"))
+    versions_dir = os.path.join(kb_dir, "versions")
+    os.makedirs(versions_dir, exist_ok=True)
+    version = time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 1_000_000:06d}"
+    tmp_path = os.path.join(versions_dir, version + ".tmp")
+    os.makedirs(tmp_path)
+    faiss.write_index(index, os.path.join(tmp_path, "faiss.index"))
+    ChunkStore.write(tmp_path, chunks)
+    bm25.save(os.path.join(tmp_path, "bm25"))
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "created_at": time.time(), "chunks": len(chunks),
+                   "index": vector_index.describe(index), "bm25_terms": len(bm25.vocab)}, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(versions_dir, version))
+
+    current_tmp = _current_path(kb_dir) + ".tmp"
+    with open(current_tmp, "w", encoding="utf-8") as f: f.write(version)
+    os.replace(current_tmp, _current_path(kb_dir))
+
+    # پوشه‌های نیمه‌کاره اجراهای قبلی و نسخه‌های قدیمی‌تر از keep نسخه آخر حذف می‌شوند
+    others = sorted(v for v in os.listdir(versions_dir) if v != version)
+    finished = [v for v in others if not v.endswith(".tmp")]
+    stale = [v for v in others if v.endswith(".tmp")] + finished[:max(0, len(finished) - (keep - 1))]
+    for old in stale:
+        shutil.rmtree(os.path.join(versions_dir, old), ignore_errors=True)
+    return version
+
+
+def memory_usage_mb() -> dict:
+    """حافظه مقیم (RSS) و سهم مشترک آن (صفحات map شده از فایل) پردازه جاری؛ فقط روی لینوکس."""
+    try:
+        with open("/proc/self/statm") as f: _, resident, shared = (int(v) for v in f.read().split()[:3])
+    except OSError:
+        return {}
+    page = os.sysconf("SC_PAGE_SIZE") / 2**20
+    return {"rss_mb": resident * page, "shared_mb": shared * page}
@@ -1,52 +1,218 @@
 import os
+import time
+import asyncio
+import random
+import hashlib
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
 import ollama
 import openai 
 import numpy as np
+from embedding_cache import get_default_cache
+
+try:
+    import tiktoken  # اختیاری: شمارش دقیق توکن برای مدل‌های OpenAI
+except ImportError:
+    tiktoken = None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """خطاهای موقت (429، 5xx و قطع اتصال) ارزش تلاش دوباره دارند."""
+    if isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError)): return True
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def _retry_after(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
 
 # این کلاس، "قرارداد" یا "جایگاه استاندارد موتور" ماست
 class LLMProvider(ABC):
+    # محدودیت‌های هر درخواست embedding؛ هر آداپتور بر اساس API خودش بازنویسی می‌کند
+    max_batch_items = 64
+    max_batch_tokens = 8000
+    max_retries = 5
+    # None یعنی کش پیش‌فرض (EMBEDDING_CACHE_PATH)؛ برای آزمون می‌توان یک EmbeddingCache جدا داد
+    embedding_cache = None
+
     @abstractmethod
     def generate_stream(self, messages: list):
         pass
 
     @abstractmethod
-    def create_embedding(self, text: str) -> list[float]:
+    def _embed_query(self, text: str) -> list[float]:
         pass
-    
+
     @abstractmethod
-    def create_document_embeddings(self, chunks: list[str]) -> list[list[float]]:
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        """یک درخواست embedding برای دسته‌ای که از محدودیت‌های API فراتر نمی‌رود."""
         pass
 
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        # برآورد محافظه‌کارانه؛ متن فارسی معمولاً بیش از یک توکن به ازای هر ۳ نویسه دارد
+        return len(text) // 2 + 1
+
+    def count_tokens(self, text: str) -> int:
+        """تعداد توکن متن برای بودجه‌بندی پرامپت؛ آداپتورهایی که شمارنده دقیق دارند بازنویسی می‌کنند."""
+        return self.estimate_tokens(text)
+
+    def _make_batches(self, chunks: list[str]) -> list[tuple[int, list[str]]]:
+        """ورودی را به دسته‌هایی با حداکثر max_batch_items تکه و max_batch_tokens توکن تقسیم می‌کند."""
+        batches, start, tokens = [], 0, 0
+        for i, chunk in enumerate(chunks):
+            cost = self.estimate_tokens(chunk)
+            if i > start and (i - start >= self.max_batch_items or tokens + cost > self.max_batch_tokens):
+                batches.append((start, chunks[start:i])); start, tokens = i, 0
+            tokens += cost
+        if start < len(chunks): batches.append((start, chunks[start:]))
+        return batches
+
+    def _embed_with_retry(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._embed_batch(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e): raise
+                # backoff نمایی با jitter؛ در صورت وجود سرآیند Retry-After همان رعایت می‌شود
+                time.sleep(_retry_after(e) or min(30.0, 2 ** attempt) * (0.5 + random.random()))
+
+    # --- رابط ناهمگام (async) ---
+    async def agenerate_stream(self, messages: list):
+        """
+        نسخه async از generate_stream. پیش‌فرض: هر گام ژنراتور هم‌گام در یک نخ جدا اجرا می‌شود
+        تا حلقه رویداد مسدود نشود. آداپتورهایی که کلاینت async دارند آن را بازنویسی می‌کنند.
+        """
+        iterator = iter(self.generate_stream(messages))
+        done = object()
+        while (chunk := await asyncio.to_thread(next, iterator, done)) is not done:
+            yield chunk
+
+    async def _aembed_query(self, text: str) -> list[float]:
+        return await asyncio.to_thread(self._embed_query, text)
+
+    async def acreate_embedding(self, text: str) -> list[float]:
+        cache = self._get_cache()
+        if cache is None: return await self._aembed_query(text)
+        provider, model = self._cache_namespace("query")
+        # فقط LRU درون حافظه روی حلقه رویداد بررسی می‌شود؛ SQLite (UPDATE/INSERT، commit و انتظار قفل) در نخ جدا اجرا می‌شود
+        cached = cache.get_memory(provider, model, text)
+        if cached is None: cached = (await asyncio.to_thread(cache.get_many, provider, model, [text]))[0]
+        if cached is not None: return cached.tolist()
+        vector = await self._aembed_query(text)
+        await asyncio.to_thread(cache.put_many, provider, model, [text], [vector])
+        return vector
+
+    def _get_cache(self):
+        return self.embedding_cache if self.embedding_cache is not None else get_default_cache()
+
+    def _cache_namespace(self, task: str) -> tuple[str, str]:
+        # embedding پرسش و سند در برخی مدل‌ها (مثل Gemini) متفاوت است، پس نوع کار هم جزء کلید است
+        return type(self).__name__, f"{self.embedding_model}:{task}"
+
+    def embedding_signature(self) -> dict:
+        """ارائه‌دهنده و مدلی که بردارهای ایندکس با آن ساخته می‌شوند (در مانیفست ingest ثبت می‌شود)."""
+        return {"provider": type(self).__name__, "embedding_model": self.embedding_model}
+
+    def create_embedding(self, text: str) -> list[float]:
+        cache = self._get_cache()
+        if cache is None: return self._embed_query(text)
+        provider, model = self._cache_namespace("query")
+        cached = cache.get_many(provider, model, [text])[0]
+        if cached is not None: return cached.tolist()
+        vector = self._embed_query(text)
+        cache.put_many(provider, model, [text], [vector])
+        return vector
+
+    def create_document_embeddings(self, chunks: list[str]) -> np.ndarray:
+        """
+        embedding تکه‌ها را به ترتیب ورودی و به صورت آرایه پیوسته float32 برمی‌گرداند.
+        تکه‌های موجود در کش دوباره ارسال نمی‌شوند.
+        """
+        cache = self._get_cache()
+        if cache is None or not chunks: return self._embed_documents(chunks)
+        provider, model = self._cache_namespace("document")
+        cached = cache.get_many(provider, model, chunks)
+        missing = list(dict.fromkeys(c for c, v in zip(chunks, cached) if v is None))
+        fresh = dict(zip(missing, self._embed_documents(missing))) if missing else {}
+        if fresh: cache.put_many(provider, model, list(fresh), list(fresh.values()))
+        hits = sum(v is not None for v in cached)
+        if hits: print(f"  - ♻️ {hits} از {len(chunks)} embedding از کش خوانده شد.")
+        return np.ascontiguousarray(np.stack([v if v is not None else fresh[c] for c, v in zip(chunks, cached)]), dtype=np.float32)
+
+    def _embed_documents(self, chunks: list[str]) -> np.ndarray:
+        """
+        embedding تکه‌ها را در دسته‌های محدود و با EMBEDDING_CONCURRENCY درخواست هم‌زمان می‌سازد
+        و یک آرایه پیوسته float32 به ترتیب ورودی برمی‌گرداند.
+        """
+        if not chunks: return np.empty((0, 0), dtype=np.float32)
+        start_time = time.perf_counter()
+        batches = self._make_batches(list(chunks))
+        concurrency = max(1, int(os.getenv("EMBEDDING_CONCURRENCY", "4")))
+        result = None
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+            futures = [(offset, pool.submit(self._embed_with_retry, texts)) for offset, texts in batches]
+            for offset, future in futures:
+                vectors = np.asarray(future.result(), dtype=np.float32)
+                if result is None: result = np.empty((len(chunks), vectors.shape[1]), dtype=np.float32)
+                result[offset:offset + len(vectors)] = vectors
+        elapsed = time.perf_counter() - start_time
+        print(f"  - ⏱️ {len(chunks)} embedding در {len(batches)} دسته، {elapsed:.2f} ثانیه ({len(chunks) / max(elapsed, 1e-9):.1f} تکه/ثانیه)")
+        return result
+
 # --- آداپتور برای Gemini API ---
 class GeminiProvider(LLMProvider):
-    # ... (این کلاس بدون تغییر باقی می‌ماند)
+    # batchEmbedContents حداکثر ۱۰۰ متن در هر درخواست می‌پذیرد
+    max_batch_items = 100
+    max_batch_tokens = 20000
+
     def __init__(self, api_key: str, model_name: str = 'gemini-1.5-flash-latest', embedding_model: str = 'models/text-embedding-004'):
         genai.configure(api_key=api_key)
         self.model_name = model_name
         self.embedding_model = embedding_model
         print("✅ ارائه‌دهنده Gemini با موفقیت مقداردهی اولیه شد.")
 
-    def generate_stream(self, messages: list):
+    def _prepare(self, messages: list):
+        # پیام سیستمی جدا می‌شود؛ فهرست ورودی تغییر نمی‌کند تا بتوان آن را دوباره ارسال کرد
         system_instruction = ""
         if messages and messages[0]['role'] == 'system':
-            system_instruction = messages.pop(0)['content']
+            system_instruction, messages = messages[0]['content'], messages[1:]
         model = genai.GenerativeModel(self.model_name, system_instruction=system_instruction)
         gemini_formatted_messages = []
         for msg in messages:
             role = 'model' if msg['role'] == 'assistant' else msg['role']
             gemini_formatted_messages.append({'role': role, 'parts': [{'text': msg['content']}]})
+        return model, gemini_formatted_messages
+
+    def generate_stream(self, messages: list):
+        model, gemini_formatted_messages = self._prepare(messages)
         stream = model.generate_content(gemini_formatted_messages, stream=True)
         for chunk in stream:
             if chunk.text: yield chunk.text
 
-    def create_embedding(self, text: str) -> list[float]:
+    async def agenerate_stream(self, messages: list):
+        model, gemini_formatted_messages = self._prepare(messages)
+        stream = await model.generate_content_async(gemini_formatted_messages, stream=True)
+        async for chunk in stream:
+            if chunk.text: yield chunk.text
+
+    def _embed_query(self, text: str) -> list[float]:
         result = genai.embed_content(model=self.embedding_model, content=text, task_type="RETRIEVAL_QUERY")
         return result["embedding"]
+
+    async def _aembed_query(self, text: str) -> list[float]:
+        result = await genai.embed_content_async(model=self.embedding_model, content=text, task_type="RETRIEVAL_QUERY")
+        return result["embedding"]
     
-    def create_document_embeddings(self, chunks: list[str]) -> list[list[float]]:
-        result = genai.embed_content(model=self.embedding_model, content=chunks, task_type="RETRIEVAL_DOCUMENT")
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        result = genai.embed_content(model=self.embedding_model, content=texts, task_type="RETRIEVAL_DOCUMENT")
         return result["embedding"]
 
 # --- آداپتور برای Ollama (مدل‌های محلی) ---
@@ -55,6 +221,7 @@ class OllamaProvider(LLMProvider):
     def __init__(self, model_name: str = 'llama3:8b-instruct', embedding_model: str = 'nomic-embed-text'):
         self.model = model_name
         self.embedding_model = embedding_model
+        self.async_client = ollama.AsyncClient()
         print("✅ ارائه‌دهنده Ollama با موفقیت مقداردهی اولیه شد.")
 
     def generate_stream(self, messages: list):
@@ -62,19 +229,39 @@ class OllamaProvider(LLMProvider):
         for chunk in stream:
             if chunk['message']['content']: yield chunk['message']['content']
 
-    def create_embedding(self, text: str) -> list[float]:
-        result = ollama.embed(model=self.embedding_model, prompt=text)
-        return result["embedding"]
+    async def agenerate_stream(self, messages: list):
+        stream = await self.async_client.chat(model=self.model, messages=messages, stream=True)
+        async for chunk in stream:
+            if chunk['message']['content']: yield chunk['message']['content']
+
+    def _embed_query(self, text: str) -> list[float]:
+        result = ollama.embed(model=self.embedding_model, input=text)
+        return result["embeddings"][0]
+
+    async def _aembed_query(self, text: str) -> list[float]:
+        result = await self.async_client.embed(model=self.embedding_model, input=text)
+        return result["embeddings"][0]
     
-    def create_document_embeddings(self, chunks: list[str]) -> list[list[float]]:
-        return [res["embedding"] for res in ollama.embed(model=self.embedding_model, prompts=chunks)]
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return ollama.embed(model=self.embedding_model, input=texts)["embeddings"]
 
 # --- VVVV آداپتور جدید برای OpenAI API VVVV ---
 class OpenAIProvider(LLMProvider):
+    # حداکثر ۲۰۴۸ ورودی و ۳۰۰ هزار توکن در هر درخواست embeddings
+    max_batch_items = 2048
+    max_batch_tokens = 250000
+
     def __init__(self, api_key: str, model_name: str = 'gpt-4o', embedding_model: str = 'text-embedding-3-small'):
         self.client = openai.OpenAI(api_key=api_key)
+        self.async_client = openai.AsyncOpenAI(api_key=api_key)
         self.model = model_name
         self.embedding_model = embedding_model
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding("o200k_base")
         print("✅ ارائه‌دهنده OpenAI با موفقیت مقداردهی اولیه شد.")
 
     def generate_stream(self, messages: list):
@@ -88,27 +275,98 @@ class OpenAIProvider(LLMProvider):
             if chunk.choices[0].delta.content:
                 yield chunk.choices[0].delta.content
 
-    def create_embedding(self, text: str) -> list[float]:
+    async def agenerate_stream(self, messages: list):
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def count_tokens(self, text: str) -> int:
+        if self._encoding is None: return self.estimate_tokens(text)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def _embed_query(self, text: str) -> list[float]:
         response = self.client.embeddings.create(
             input=[text],
             model=self.embedding_model
         )
         return response.data[0].embedding
+
+    async def _aembed_query(self, text: str) -> list[float]:
+        response = await self.async_client.embeddings.create(
+            input=[text],
+            model=self.embedding_model
+        )
+        return response.data[0].embedding
     
-    def create_document_embeddings(self, chunks: list[str]) -> list[list[float]]:
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
         response = self.client.embeddings.create(
-            input=chunks,
+            input=texts,
             model=self.embedding_model
         )
-        return [item.embedding for item in response.data]
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
-# --- تابع "کارخانه" (به‌روز شده) ---
-def get_llm_provider():
+# --- آداپتور جعلی محلی (برای آزمون و سنجش بدون مصرف سهمیه API) ---
+class FakeProvider(LLMProvider):
     """
-    متغیر محیطی AI_PROVIDER را خوانده و نمونه مناسب از ارائه‌دهنده را برمی‌گرداند.
+    embedding قطعی بر اساس هش متن و پاسخ ثابت؛ تأخیر و خطای موقت قابل شبیه‌سازی است.
+    با ttft و tokens_per_second رفتار جریانی یک مدل واقعی را بدون مصرف سهمیه API برای آزمون بار تقلید می‌کند.
     """
-    provider_name = os.getenv("AI_PROVIDER", "gemini").lower()
-    
+    RESPONSE = "این یک پاسخ آزمایشی از ارائه‌دهنده جعلی است که برای سنجش کارایی سرویس بدون مصرف سهمیه API استفاده می‌شود."
+
+    def __init__(self, dim: int = 768, embedding_latency: float = 0.0, fail_rate: float = 0.0,
+                 ttft: float = 0.0, tokens_per_second: float = 0.0, response_tokens: int = 0):
+        self.dim = dim
+        self.embedding_model = f"fake-{dim}"
+        self.embedding_latency = embedding_latency
+        self.fail_rate = fail_rate
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+
+    def _tokens(self) -> list[str]:
+        words = self.RESPONSE.split(" ")
+        count = self.response_tokens or len(words)
+        return [words[i % len(words)] + ("" if i == count - 1 else " ") for i in range(count)]
+
+    def generate_stream(self, messages: list):
+        if self.ttft: time.sleep(self.ttft)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise ConnectionError("خطای موقت شبیه‌سازی شده")
+        for i, token in enumerate(self._tokens()):
+            if i and self.tokens_per_second: time.sleep(1 / self.tokens_per_second)
+            yield token
+
+    async def agenerate_stream(self, messages: list):
+        # با asyncio.sleep تا تأخیر شبیه‌سازی شده نخ‌های thread pool را اشغال نکند
+        if self.ttft: await asyncio.sleep(self.ttft)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise ConnectionError("خطای موقت شبیه‌سازی شده")
+        for i, token in enumerate(self._tokens()):
+            if i and self.tokens_per_second: await asyncio.sleep(1 / self.tokens_per_second)
+            yield token
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+
+    def _embed_query(self, text: str) -> list[float]:
+        if self.embedding_latency: time.sleep(self.embedding_latency)
+        return self._vector(text).tolist()
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        if self.embedding_latency: time.sleep(self.embedding_latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise ConnectionError("خطای موقت شبیه‌سازی شده")
+        return np.stack([self._vector(t) for t in texts])
+
+# --- تابع "کارخانه" (به‌روز شده) ---
+def create_provider(provider_name: str) -> LLMProvider:
+    """یک ارائه‌دهنده را با نامش ('gemini'، 'openai'، 'ollama' یا 'fake') می‌سازد."""
     if provider_name == "ollama":
         try:
             ollama.ps()
@@ -129,6 +387,32 @@ def get_llm_provider():
         if not api_key:
             raise ValueError("برای استفاده از Gemini، متغیر GEMINI_API_KEY باید تنظیم شود.")
         return GeminiProvider(api_key=api_key)
+
+    # ارائه‌دهنده محلی برای آزمون بار و بنچمارک (benchmarks/load_test.py)
+    elif provider_name == "fake":
+        return FakeProvider(ttft=float(os.getenv("FAKE_TTFT_MS", "300")) / 1000,
+                            tokens_per_second=float(os.getenv("FAKE_TOKENS_PER_SECOND", "50")),
+                            response_tokens=int(os.getenv("FAKE_RESPONSE_TOKENS", "100")),
+                            embedding_latency=float(os.getenv("FAKE_EMBEDDING_LATENCY_MS", "0")) / 1000)
     
     else:
-        raise ValueError(f"ارائه‌دهنده '{provider_name}' پشتیبانی نمی‌شود. لطفاً یکی از مقادیر 'gemini', 'openai', یا 'ollama' را انتخاب کنید.")
\ No newline at end of file
+        raise ValueError(f"ارائه‌دهنده '{provider_name}' پشتیبانی نمی‌شود. لطفاً یکی از مقادیر 'gemini', 'openai', 'ollama' یا 'fake' را انتخاب کنید.")
+
+def get_llm_provider():
+    """
+    متغیر محیطی AI_PROVIDER را خوانده و نمونه مناسب از ارائه‌دهنده را برمی‌گرداند.
+    AI_PROVIDER می‌تواند فهرستی به ترتیب اولویت باشد (مثلاً "gemini,ollama")؛ ارائه‌دهنده‌ها در RouterProvider
+    با محدودیت هم‌زمانی، قطع‌کننده مدار و failover پوشش داده می‌شوند. اولی ارائه‌دهنده embedding است و اگر
+    راه‌اندازی نشود خطا برمی‌گردد؛ بقیه اگر در دسترس نباشند با مدار باز ثبت و بعداً دوباره ساخته می‌شوند.
+    """
+    from provider_router import RouterProvider
+    names = [name.strip().lower() for name in os.getenv("AI_PROVIDER", "gemini").split(",") if name.strip()] or ["gemini"]
+    providers = [(names[0], create_provider(names[0]))]
+    for name in names[1:]:
+        try:
+            providers.append((name, create_provider(name)))
+        except ConnectionError as e:
+            # خطای پیکربندی (ValueError) دوباره امتحان نمی‌شود؛ فقط در دسترس نبودن موقت
+            print(f"⚠️ ارائه‌دهنده '{name}' در دسترس نیست و پس از مهلت مدار دوباره امتحان می‌شود: {e}")
+            providers.append((name, None))
+    return RouterProvider(providers, factory=create_provider)
@@ -1,155 +1,331 @@
 import os
-import pickle
+import hmac
+import asyncio
 import numpy as np
-import faiss
 import json
 import logging
 from logging.handlers import RotatingFileHandler
-from fastapi import FastAPI, HTTPException, Body, Query
-from fastapi.responses import HTMLResponse, StreamingResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Query, Header, Depends, Request
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
+
+# .env باید پیش از import ماژول‌های محلی بارگذاری شود، چون آن‌ها تنظیمات را هنگام import می‌خوانند
+load_dotenv()
 import database
+import auth
 import prompt_manager
 from llm_providers import get_llm_provider
+from retriever import HybridRetriever
+from reranker import load_reranker
+from context_builder import ContextBuilder, ConversationSummarizer
+from semantic_cache import SemanticCache
+import knowledge_base
+import vector_index
+from static_assets import StaticAssets
+import telemetry
 
 # --- ۱. راه‌اندازی سیستم لاگینگ ---
-log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s (%(filename)s:%(lineno)d)')
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - [%(trace_id)s] %(message)s (%(filename)s:%(lineno)d)')
 log_file = 'app.log'
 file_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5)
 file_handler.setFormatter(log_formatter)
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(log_formatter)
+for handler in (file_handler, console_handler): handler.addFilter(telemetry.TraceIdFilter())
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
-# --- بارگذاری و تنظیمات اولیه ---
-load_dotenv()
+# --- تنظیمات اولیه ---
 app = FastAPI()
 
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "10"))
+# مرجع taskهای پس‌زمینه نگه داشته می‌شود تا پیش از پایان جمع‌آوری نشوند و در خاموشی لغو شوند
+_background_tasks = set()
+
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     database.init_db()
+    # کلید نشست در راه‌اندازی بارگذاری می‌شود تا مشکل فایل کلید پیش از اولین ورود دیده شود
+    auth.session_secret()
+    if KB_WATCH_INTERVAL > 0: _background_tasks.add(asyncio.create_task(watch_knowledge_base(KB_WATCH_INTERVAL)))
     logger.info("Application startup complete. Database initialized.")
+    logger.info(f"Prompt version '{prompt_manager.PROMPT_VERSION}' (profile cache {prompt_manager.PROFILE_CACHE_SIZE}); "
+                f"DB profile cache size={database._PROFILE_CACHE_SIZE}, ttl={database._PROFILE_CACHE_TTL:.0f}s.")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in _background_tasks: task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
 
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(telemetry.TelemetryMiddleware)
 
 try:
     llm_provider = get_llm_provider()
-    logger.info(f"LLM Provider '{os.getenv('AI_PROVIDER', 'gemini').lower()}' initialized successfully.")
+    provider_name = getattr(llm_provider, "name", os.getenv('AI_PROVIDER', 'gemini').lower())
+    logger.info(f"LLM Provider '{provider_name}' initialized successfully.")
 except (ValueError, ConnectionError) as e:
     logger.critical(f"Could not initialize LLM Provider: {e}", exc_info=True)
     exit()
 
 try:
-    index = faiss.read_index("faiss_index.bin")
-    with open("chunks.pkl", "rb") as f: chunks = pickle.load(f)
-    with open("bm25_index.pkl", "rb") as f: bm25_index = pickle.load(f)
-    logger.info("FAISS and BM25 knowledge bases loaded successfully.")
+    reranker = load_reranker()
+    if reranker: logger.info(f"Reranker loaded (top_n={reranker.top_n}, deadline={reranker.deadline_ms:.0f} ms, batch={reranker.batch_size}).")
 except Exception as e:
-    logger.error(f"Error loading knowledge bases: {e}", exc_info=True)
-    index = None; bm25_index = None
+    logger.error(f"Could not load reranker, continuing with fused ranking: {e}", exc_info=True)
+    reranker = None
+
+def load_knowledge_base():
+    """نسخه فعلی پایگاه دانش (kb/CURRENT) و retriever آن؛ (None, None) اگر در دسترس نباشد."""
+    try:
+        kb = knowledge_base.load_current()
+    except Exception as e:
+        logger.error(f"Error loading knowledge bases: {e}", exc_info=True)
+        return None, None
+    if kb is None:
+        logger.warning("No knowledge base found; run ingest.py to build one. Chat will run without retrieval.")
+        return None, None
+    if kb.version == "legacy":
+        logger.warning("Loaded legacy faiss_index.bin/chunks.pkl; re-run ingest.py to build the versioned, mmap-able kb/ directory.")
+    memory = knowledge_base.memory_usage_mb()
+    logger.info(f"Knowledge base '{kb.version}' loaded in {kb.load_ms:.0f} ms: FAISS ({vector_index.describe(kb.index)}), "
+                f"{len(kb.chunks)} chunks, {len(kb.bm25.vocab)} BM25 terms; "
+                f"rss={memory.get('rss_mb', 0):.0f} MB (shared {memory.get('shared_mb', 0):.0f} MB)")
+    return kb, (HybridRetriever(llm_provider, kb.index, kb.chunks, kb.bm25, reranker=reranker) if len(kb.chunks) else None)
+
+kb, retriever = load_knowledge_base()
+_kb_reload_lock = asyncio.Lock()
+
+async def reload_knowledge_base(force: bool = False) -> bool:
+    """
+    اگر CURRENT به نسخه دیگری اشاره کند، آن را در یک نخ جدا بارگذاری و سپس ارجاع‌ها را یکجا جایگزین می‌کند.
+    درخواست‌های در جریان retriever قبلی را تا پایان نگه می‌دارند.
+    """
+    global kb, retriever
+    async with _kb_reload_lock:
+        version = knowledge_base.current_version()
+        if version is None or (not force and kb is not None and version == kb.version): return False
+        new_kb, new_retriever = await asyncio.to_thread(load_knowledge_base)
+        if new_kb is None: return False
+        kb, retriever = new_kb, new_retriever
+        semantic_cache.set_kb_version(new_kb.version)
+        return True
+
+async def watch_knowledge_base(interval: float):
+    """هر worker به صورت جداگانه CURRENT را بررسی می‌کند، پس همه workerها نسخه جدید را برمی‌دارند."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await reload_knowledge_base(): logger.info(f"Switched to knowledge base version '{kb.version}'.")
+        except Exception as e:
+            logger.error(f"Knowledge base reload failed: {e}", exc_info=True)
+
+context_builder = ContextBuilder(llm_provider)
+summarizer = ConversationSummarizer(llm_provider)
+semantic_cache = SemanticCache()
+semantic_cache.set_kb_version(kb.version if kb else None)
 
 # --- مدل‌های Pydantic ---
 class UserCreate(BaseModel): username: str; password: str; experience: int; subject: str; field: str
 class UserLogin(BaseModel): username: str; password: str
-class NewConversationRequest(BaseModel): user_id: int; first_message: str
+class NewConversationRequest(BaseModel): first_message: str
 class ChatRequest(BaseModel): conversation_id: str; message: str
-class FeedbackRequest(BaseModel): message_id: int; user_id: int; rating: int
+class FeedbackRequest(BaseModel): message_id: int; rating: int
+class ProfileUpdate(BaseModel): experience: int; subject: str; field: str
+
 
+# فایل‌های static یک بار در راه‌اندازی خوانده و فشرده می‌شوند؛ تغییر آن‌ها نیاز به راه‌اندازی دوباره دارد
+static_assets = StaticAssets("static")
+logger.info(f"Static assets loaded: {static_assets.stats()}")
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def serve_static(request: Request, path: str): return static_assets.response(request, path)
 
-@app.get("/", response_class=HTMLResponse)
-async def serve_login_page():
-    with open("static/login.html", encoding="utf-8") as f: return f.read()
+@app.api_route("/", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def serve_login_page(request: Request): return static_assets.response(request, "login.html")
 
-@app.get("/app.html", response_class=HTMLResponse)
-async def serve_app_page():
-    with open("static/app.html", encoding="utf-8") as f: return f.read()
+@app.api_route("/app.html", methods=["GET", "HEAD"], response_class=HTMLResponse)
+async def serve_app_page(request: Request): return static_assets.response(request, "app.html")
 
 @app.get("/health")
-async def health_check(): return {"status": "ok"}
+async def health_check():
+    status = llm_provider.status() if hasattr(llm_provider, "status") else None
+    return {"status": "ok", "providers": status} if status else {"status": "ok"}
+
+async def require_admin(x_admin_token: str | None = Header(None)):
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token or not hmac.compare_digest(x_admin_token or "", admin_token):
+        raise HTTPException(status_code=403, detail="دسترسی غیرمجاز")
+
+@app.post("/api/admin/reload_kb", dependencies=[Depends(require_admin)])
+async def admin_reload_kb():
+    reloaded = await reload_knowledge_base(force=True)
+    return {"reloaded": reloaded, "version": kb.version if kb else None}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    if not telemetry.ENABLED: raise HTTPException(status_code=404, detail="Telemetry is disabled.")
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# شمارنده‌های کش معنایی در /metrics هم منتشر می‌شوند؛ این endpoint جزئیات داخلی را فقط برای مدیر نشان می‌دهد
+@app.get("/api/semantic_cache/stats", dependencies=[Depends(require_admin)])
+async def semantic_cache_stats(): return semantic_cache.stats()
+
+# --- احراز هویت: توکن نشست در سرآیند Authorization: Bearer <token> ---
+async def get_current_user(authorization: str | None = Header(None)) -> int:
+    scheme, _, token = (authorization or "").partition(" ")
+    user_id = auth.verify_session_token(token) if scheme.lower() == "bearer" else None
+    if user_id is None: raise HTTPException(status_code=401, detail="نشست نامعتبر یا منقضی شده است؛ دوباره وارد شوید.")
+    return user_id
+
+async def get_owned_conversation(conversation_id: str, user_id: int) -> dict:
+    """پروفایل مالک گفتگو (از کش)؛ اگر گفتگو وجود نداشته باشد یا متعلق به کاربر نباشد 404."""
+    profile = await database.aget_profile_by_conversation(conversation_id)
+    if not profile or profile["id"] != user_id: raise HTTPException(status_code=404, detail="گفتگو یافت نشد")
+    return profile
 
 # --- API های کاربران و گفتگوها ---
 @app.post("/api/register")
 async def register_user(user: UserCreate):
-    db_user = database.get_user(user.username)
+    db_user = await database.aget_user(user.username)
     if db_user: raise HTTPException(status_code=400, detail="نام کاربری تکراری است")
-    new_user = database.create_user(user.username, user.password, user.experience, user.subject, user.field)
+    hashed_password = await auth.ahash_password(user.password)
+    new_user = await database.acreate_user(user.username, hashed_password, user.experience, user.subject, user.field)
+    if not new_user: raise HTTPException(status_code=400, detail="نام کاربری تکراری است")
     return {"message": "کاربر با موفقیت ایجاد شد", "user": new_user}
 
 @app.post("/api/login")
 async def login_user(user: UserLogin):
-    db_user = database.get_user(user.username)
-    if not db_user or not database.verify_password(user.password, db_user["hashed_password"]):
+    db_user = await database.aget_user(user.username)
+    if not db_user or not await auth.averify_password(user.password, db_user["hashed_password"]):
         raise HTTPException(status_code=401, detail="نام کاربری یا رمز عبور اشتباه است")
     user_data = dict(db_user)
     user_data.pop("hashed_password")
-    return {"message": "ورود موفقیت‌آمیز بود", "user": user_data}
+    return {"message": "ورود موفقیت‌آمیز بود", "user": user_data, "token": auth.create_session_token(user_data["id"])}
 
-@app.get("/api/conversations/{user_id}")
-async def get_conversations(user_id: int):
-    return database.get_user_conversations(user_id)
+@app.put("/api/profile")
+async def update_profile(profile: ProfileUpdate, user_id: int = Depends(get_current_user)):
+    success = await database.aupdate_user_profile(user_id, profile.experience, profile.subject, profile.field)
+    if not success: raise HTTPException(status_code=404, detail="کاربر یافت نشد")
+    return {"message": "پروفایل با موفقیت به‌روز شد"}
+
+@app.get("/api/conversations")
+async def get_conversations(user_id: int = Depends(get_current_user)):
+    return await database.aget_user_conversations(user_id)
 
 @app.post("/api/start_conversation")
-async def start_conversation(request: NewConversationRequest):
-    conv_id = database.create_conversation(request.user_id, request.first_message[:50])
+async def start_conversation(request: NewConversationRequest, user_id: int = Depends(get_current_user)):
+    conv_id = await database.acreate_conversation(user_id, request.first_message[:50])
     return {"conversation_id": conv_id}
 
 @app.get("/api/messages/{conversation_id}")
-async def get_conversation_messages(conversation_id: str, page: int = 1, limit: int = 20):
-    return database.get_messages(conversation_id, page, limit)
+async def get_conversation_messages(conversation_id: str, limit: int = Query(20, ge=1, le=100),
+                                    before_id: int | None = None, after_id: int | None = None,
+                                    user_id: int = Depends(get_current_user)):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="before_id و after_id را نمی‌توان با هم استفاده کرد")
+    await get_owned_conversation(conversation_id, user_id)
+    return await database.aget_messages(conversation_id, limit, before_id=before_id, after_id=after_id)
 
 @app.delete("/api/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: str, user_id: int = Body(..., embed=True)):
-    success = database.delete_conversation(conversation_id, user_id)
+async def delete_conversation(conversation_id: str, user_id: int = Depends(get_current_user)):
+    success = await database.adelete_conversation(conversation_id, user_id)
     if not success: raise HTTPException(status_code=404, detail="گفتگو یافت نشد")
     return {"message": "گفتگو با موفقیت حذف شد"}
 
 @app.post("/api/feedback")
-async def handle_feedback(request: FeedbackRequest):
-    database.add_feedback(request.message_id, request.user_id, request.rating)
+async def handle_feedback(request: FeedbackRequest, user_id: int = Depends(get_current_user)):
+    await database.aadd_feedback(request.message_id, user_id, request.rating)
     return {"message": "بازخورد شما با موفقیت ثبت شد."}
 
 # --- API اصلی چت ---
+HISTORY_MESSAGES = int(os.getenv("HISTORY_MESSAGES", "10"))
+
+CACHED_STREAM_CHUNK_CHARS = 64
+
+async def cached_response_generator(conversation_id: str, answer: str):
+    """پاسخ کش شده را مانند پاسخ مدل به صورت جریانی می‌فرستد و در تاریخچه ثبت می‌کند."""
+    for start in range(0, len(answer), CACHED_STREAM_CHUNK_CHARS):
+        yield answer[start:start + CACHED_STREAM_CHUNK_CHARS]
+    await database.aadd_message(conversation_id, "model", answer)
+    yield f""
+
 @app.post("/api/chat")
-async def chat_handler(request: ChatRequest):
+async def chat_handler(request: ChatRequest, user_id: int = Depends(get_current_user)):
     conversation_id = request.conversation_id
     user_message = request.message
     logger.info(f"Received new chat message for conversation_id: {conversation_id}")
+    trace = telemetry.current_trace()
     
     try:
-        database.add_message(conversation_id, "user", user_message)
-        history = database.get_messages(conversation_id, page=1, limit=10)
-        user_info = database.get_user_by_conversation(conversation_id)
-        if not user_info:
-            raise HTTPException(status_code=404, detail="کاربر برای این گفتگو یافت نشد.")
+        with trace.stage("db_profile"):
+            user_info = await get_owned_conversation(conversation_id, user_id)
+        with trace.stage("db_add_message"):
+            user_message_id = await database.aadd_message(conversation_id, "user", user_message)
+        with trace.stage("db_history"):
+            summary, summarized_until = await summarizer.get(conversation_id)
+            history = await database.aget_recent_messages(conversation_id, HISTORY_MESSAGES, before_id=user_message_id)
+        # پیام‌هایی که در خلاصه آمده‌اند دوباره فرستاده نمی‌شوند
+        history = [msg for msg in history if msg["id"] > summarized_until]
         
        
-        search_query = user_message # ...
-        retrieved_context = "" # ...
-        
-        system_instruction = prompt_manager.create_system_instruction(dict(user_info))
-        final_prompt_text = prompt_manager.create_final_prompt_with_context(user_message, retrieved_context)
+        search_query = user_message
+        # ارجاع ثابت برای کل درخواست، حتی اگر در این بین نسخه پایگاه دانش عوض شود
+        active_retriever = retriever
+        # کش معنایی فقط برای اولین پیام گفتگو؛ پاسخ پیام‌های بعدی به تاریخچه وابسته است
+        bucket = prompt_manager.profile_bucket(user_info)
+        cacheable = semantic_cache.enabled and not history and not summary
+        query_vector = None
+        if cacheable:
+            try:
+                with trace.stage("embedding"):
+                    query_vector = await llm_provider.acreate_embedding(search_query)
+                with trace.stage("semantic_cache"):
+                    cached_answer = semantic_cache.lookup(bucket, query_vector)
+            except Exception as e:
+                logger.error(f"Semantic cache lookup failed for conversation_id {conversation_id}: {e}", exc_info=True)
+                cacheable, cached_answer = False, None
+            if cached_answer is not None:
+                logger.info(f"Semantic cache hit for conversation_id {conversation_id} (hit rate {semantic_cache.stats()['hit_rate']:.2%}; {trace.summary()})")
+                return StreamingResponse(cached_response_generator(conversation_id, cached_answer), media_type="text/plain; charset=utf-8")
+
+        retrieved_chunks = []
+        if active_retriever:
+            try:
+                with trace.stage("retrieval"):
+                    retrieval = await active_retriever.aretrieve(search_query, query_vector)
+                retrieved_chunks = retrieval.chunks
+                for name, value in retrieval.timings.items(): trace.record(f"retrieval_{name.removesuffix('_ms')}", value / 1000)
+                timings = ", ".join(f"{name}={value:.2f}" for name, value in retrieval.timings.items())
+                logger.info(f"Retrieved {len(retrieval.chunk_ids)} chunks for conversation_id {conversation_id} in {retrieval.total_ms:.2f} ms "
+                            f"({timings}{', reranked' if retrieval.reranked else ''})")
+            except Exception as e:
+                logger.error(f"Retrieval failed for conversation_id {conversation_id}: {e}", exc_info=True)
         
-        messages = [{"role": "system", "content": system_instruction}]
-        for msg in history[:-1]:
-            role = "assistant" if msg["role"] == "model" else msg["role"]
-            messages.append({"role": role, "content": msg["content"]})
-        messages.append({"role": "user", "content": final_prompt_text})
+        system_instruction = prompt_manager.create_system_instruction(user_info)
+        with trace.stage("context_build"):
+            context = context_builder.build(system_instruction, user_message, history, retrieved_chunks, summary)
+        messages = context.messages
+        logger.info(f"Prompt for conversation_id {conversation_id}: {context.prompt_tokens} tokens "
+                    f"(history {context.history_used}/{len(history)}, chunks {context.chunks_used}/{len(retrieved_chunks)}, summary={'yes' if summary else 'no'})")
 
         async def response_generator():
             full_response = ""
-            stream = llm_provider.generate_stream(messages)
-            for chunk in stream:
+            # متریک‌های TTFT و خطای مدل را RouterProvider به نام ارائه‌دهنده‌ای که پاسخ را سرو کرده ثبت می‌کند
+            async for chunk in llm_provider.agenerate_stream(messages):
                 full_response += chunk
                 yield chunk
-            message_id = database.add_message(conversation_id, "model", full_response)
+            with trace.stage("db_save_reply"):
+                message_id = await database.aadd_message(conversation_id, "model", full_response)
+            if cacheable and query_vector is not None: semantic_cache.store(bucket, query_vector, full_response)
+            summarizer.schedule(conversation_id, on_error=lambda e: logger.error(
+                f"Summary refresh failed for conversation_id {conversation_id}: {e}", exc_info=e))
+            if telemetry.ENABLED: logger.info(f"Chat trace for conversation_id {conversation_id}: {trace.summary()}")
             yield f""
         
         return StreamingResponse(response_generator(), media_type="text/plain; charset=utf-8")
@@ -0,0 +1,77 @@
+# persian_text.py - نرمال‌سازی و توکن‌سازی متن فارسی، مشترک بین ingest (ساخت BM25) و مسیر پرسش
+import os
+import re
+import string
+
+# نسخه قواعد توکن‌سازی؛ هر تغییری در نگاشت‌ها، ایست‌واژه‌ها یا ریشه‌یابی باید آن را بالا ببرد
+TOKENIZER_VERSION = "fa-1"
+
+_CHAR_MAP = {
+    # ی و ک عربی، و شکل‌های دیگر الف، واو و ه
+    "ي": "ی", "ى": "ی", "ئ": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه", "ؤ": "و", "أ": "ا", "إ": "ا", "ٱ": "ا",
+    # نیم‌فاصله و نویسه‌های نامرئی: «می‌شود» و «میشود» یک واژه می‌شوند
+    "\u200c": "", "\u200d": "", "\u200e": "", "\u200f": "", "\ufeff": "", "\u00ad": "",
+    # کشیده و اعراب
+    "\u0640": "", **{chr(c): "" for c in range(0x064B, 0x0660)}, "\u0670": "",
+}
+# ارقام فارسی و عربی به ارقام لاتین
+_CHAR_MAP.update({chr(0x06F0 + d): str(d) for d in range(10)})
+_CHAR_MAP.update({chr(0x0660 + d): str(d) for d in range(10)})
+# علائم نگارشی (لاتین و فارسی) به فاصله تا از واژه جدا شوند
+_CHAR_MAP.update({c: " " for c in string.punctuation + "«»،؛؟٪×÷–—…“”‘’•·"})
+_TRANSLATION = str.maketrans(_CHAR_MAP)
+
+STOPWORDS = frozenset("""
+و در به از که این را با است برای آن یک تا بر یا هم نیز اما اگر پس چون چه همه هر ها های ای
+می شود شد شده بود میشود میشوند میکند میکنند میباشد نمیشود باشد باشند هست نیست کند کنند کرد کرده کردن دارد دارند داشت خواهد بوده
+ما من تو او شما آنها ایشان خود وی آن‌ها
+بین روی زیر پیش پس بعد قبل دیگر چند نه بی همین همان چنین چنان آنچه اینکه آنکه بیش کم
+یعنی مثل مانند درباره توسط طی ولی لذا زیرا بنابراین سپس
+""".translate(_TRANSLATION).split())
+
+# پسوندهای جمع و صفت عالی؛ فقط وقتی حذف می‌شوند که دست‌کم سه حرف باقی بماند («تنها» دست نمی‌خورد)
+_SUFFIXES = ("هایی", "های", "ها", "ترین")
+_MIN_STEM = 3
+_WORD_SPLIT = re.compile(r"\s+")
+
+
+def default_stemming() -> bool:
+    return os.getenv("BM25_STEMMING", "1") != "0"
+
+
+def tokenizer_version(stem: bool = None) -> str:
+    """شناسه‌ای که در فراداده ایندکس BM25 ذخیره می‌شود تا ایندکس و پرسش همیشه یکسان توکن شوند."""
+    if stem is None: stem = default_stemming()
+    return TOKENIZER_VERSION + ("+stem" if stem else "")
+
+
+def normalize(text: str) -> str:
+    return text.translate(_TRANSLATION).lower()
+
+
+def light_stem(token: str) -> str:
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= _MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str, stem: bool = None) -> list[str]:
+    if stem is None: stem = default_stemming()
+    tokens = [t for t in _WORD_SPLIT.split(normalize(text)) if t and t not in STOPWORDS]
+    return [light_stem(t) for t in tokens] if stem else tokens
+
+
+def _legacy_tokenize(text: str) -> list[str]:
+    return text.split(" ")
+
+
+def tokenizer_for(version: str | None):
+    """
+    تابع توکن‌سازی متناظر با نسخه ذخیره‌شده در یک ایندکس. None یعنی ایندکس قدیمی که با split(" ") ساخته شده است.
+    برای نسخه ناشناخته None برمی‌گرداند تا فراخواننده تصمیم بگیرد (مثلاً ساخت دوباره ایندکس).
+    """
+    if version is None: return _legacy_tokenize
+    if version == tokenizer_version(False): return lambda text: tokenize(text, stem=False)
+    if version == tokenizer_version(True): return lambda text: tokenize(text, stem=True)
+    return None
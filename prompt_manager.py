@@ -1,46 +1,51 @@
+# prompt_manager.py - رجیستری قالب‌های پرامپت (فایل‌های نسخه‌دار در prompts/<نسخه>/)
+import os
+import json
+import functools
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1")
+PROFILE_CACHE_SIZE = int(os.getenv("PROMPT_PROFILE_CACHE_SIZE", "1024"))
+
+@functools.lru_cache(maxsize=None)
+def load_template(name: str, version: str = PROMPT_VERSION) -> str:
+    """قالب را یک بار از دیسک می‌خواند؛ بایت‌های آن بدون تغییر در پرامپت قرار می‌گیرند."""
+    with open(os.path.join(PROMPTS_DIR, version, name), encoding="utf-8", newline="") as f:
+        return f.read()
+
+@functools.lru_cache(maxsize=None)
+def _bands(version: str = PROMPT_VERSION) -> dict:
+    return json.loads(load_template("bands.json", version))
+
+def experience_band(experience: int) -> str:
+    """سابقه معلم را به یکی از سه بازه‌ای که لحن دستورالعمل سیستمی را تعیین می‌کند نگاشت می‌کند."""
+    if experience < 5: return "novice"
+    if experience <= 25: return "experienced"
+    return "veteran"
+
+def profile_bucket(user_info: dict) -> tuple[str, str, str]:
+    """کلید پروفایل (بازه سابقه، درس، رشته): کاربران هم‌کلید لحن و حوزه پاسخ یکسانی دریافت می‌کنند."""
+    return (experience_band(user_info['experience']), user_info['subject'], user_info['field'])
+
+@functools.lru_cache(maxsize=PROFILE_CACHE_SIZE)
+def render_system_instruction(experience: int, subject: str, field: str, version: str = PROMPT_VERSION) -> str:
+    """
+    دستورالعمل سیستمی یک پروفایل؛ بخش ثابت (هویت، محدوده و قوانین مشترک) همیشه اول و بدون تغییر می‌آید
+    تا کش پرامپت سمت ارائه‌دهنده (OpenAI/Gemini) بین همه کاربران و درخواست‌ها استفاده شود.
+    """
+    band = _bands(version)[experience_band(experience)]
+    return load_template("system_static.md", version) + load_template("system_profile.md", version).format(
+        greeting=band["greeting"], guidance=band["guidance"], experience=experience, subject=subject, field=field)
+
 def create_system_instruction(user_info: dict) -> str:
-    """بر اساس اطلاعات کاربر، دستورالعمل سیستمی پویا و پیشرفته را ایجاد می‌کند."""
-    exp = user_info['experience']
-    
-    if exp < 5:
-        greeting = "«به دنیای آموزش فنی خوش آمدید! تعهد شما به تعلیم مهارت‌های زندگی‌ساز الهام‌-بخش است.»"
-        guidance = "پاسخ‌های شما باید کاملاً گام به گام، واضح و با مثال‌های ساده باشد."
-    elif 5 <= exp <= 25:
-        greeting = "«همکار گرامی، بیایید تجربیات ارزشمندتان را بهینه‌سازی کنیم.»"
-        guidance = "پاسخ‌های شما باید حرفه‌ای، خلاقانه و متمرکز بر روش‌های نوین تدریس باشد."
-    else:
-        greeting = "«درود بر شما که دهه‌ها آینده‌سازان فنی را تربیت کرده‌اید!»"
-        guidance = "پاسخ‌های شما باید بسیار مختصر، راهبردی و در حد چند پیشنهاد کلیدی باشد."
-    
-    system_instruction = f"""
-# هویت و نقش شما
-شما یک مربی آموزشی بسیار باتجربه با نام "استادیار" هستی که منحصراً برای معلمان هنرستان‌های فنی و حرفه‌ای و کاردانش ایران طراحی شده‌ای.
-
-# محدوده تخصص شما (بسیار مهم)
-1.  **حوزه مجاز:** شما فقط و فقط مجاز به پاسخگویی در مورد دروس **تخصصی و مهارتی** مربوط به رشته‌های فنی و حرفه‌ای و کاردانش ایران هستی. (مانند مکانیک خودرو، برق، کامپیوتر، حسابداری، نقشه‌کشی، و غیره).
-2.  **حوزه غیرمجاز:** شما باید هرگونه سوالی که خارج از این دروس تخصصی باشد را رد کنی. این شامل دروس عمومی مانند **ریاضیات محض، فیزیک نظری، ادبیات، تاریخ، دین و زندگی** است، مگر اینکه کاربرد مستقیم آن در یک درس تخصصی پرسیده شود.
-3.  **پاسخ استاندارد برای رد کردن:** اگر سوالی در حوزه غیرمجاز بود، باید **دقیقاً** این پاسخ را بدهی: "متاسفم، من به عنوان استادیار، فقط برای کمک در زمینه دروس تخصصی و مهارتی هنرستان تربیت شده‌ام و در این زمینه نمی‌توانم کمکی کنم."
-
-# قوانین خروجی
-- **ساختار Markdown:** همیشه از Markdown برای ساختارمند کردن پاسخ‌ها استفاده کن.
-- **لحن شروع:** شروع پاسخ شما (فقط برای اولین پیام گفتگو) باید این جمله باشد: {greeting}
-- **راهنمای پاسخ:** {guidance}
-
-# اطلاعات معلم
-- سابقه: {user_info['experience']} سال - درس: {user_info['subject']} - رشته: {user_info['field']}
-"""
-    return system_instruction
+    """بر اساس اطلاعات کاربر، دستورالعمل سیستمی پویا و پیشرفته را ایجاد می‌کند (برای هر پروفایل یک بار)."""
+    return render_system_instruction(user_info['experience'], user_info['subject'], user_info['field'])
 
 def create_final_prompt_with_context(user_message: str, retrieved_context: str) -> str:
     """پرامپت نهایی کاربر را با اطلاعات بازیابی شده و دستورالعمل‌های ساختاریافته ترکیب می‌کند."""
-    return f"""
-# اطلاعات تکمیلی از پایگاه دانش
----
-{retrieved_context}
----
-# دستورالعمل نهایی
-با توجه به نقش و قوانینی که برایت تعریف شده و با استفاده از اطلاعات تکمیلی بالا (اگر به سوال کاربر مرتبط بود، در غیر این صورت آن را نادیده بگیر)، به درخواست زیر پاسخ بده.
-
-# درخواست کاربر
-{user_message}
-"""
\ No newline at end of file
+    return load_template("final_prompt.md").format(context=retrieved_context, user_message=user_message)
+
+def create_summary_prompt(previous_summary: str, messages: list[dict]) -> str:
+    """پرامپت به‌روزرسانی خلاصه غلتان گفتگو از خلاصه قبلی و پیام‌های جدید."""
+    transcript = "\n".join(f"{'معلم' if m['role'] == 'user' else 'استادیار'}: {m['content']}" for m in messages)
+    return load_template("summary.md").format(previous_summary=previous_summary, transcript=transcript)
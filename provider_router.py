@@ -0,0 +1,315 @@
+# provider_router.py - مسیریابی درخواست‌های مدل بین چند ارائه‌دهنده با محدودیت هم‌زمانی، قطع‌کننده مدار، failover و hedging
+import os
+import time
+import asyncio
+import telemetry
+from llm_providers import LLMProvider
+
+# سقف هم‌زمانی و نرخ هر ارائه‌دهنده را می‌توان جداگانه تنظیم کرد، مثلاً ROUTER_MAX_CONCURRENCY_OLLAMA=2
+ROUTER_MAX_CONCURRENCY = int(os.getenv("ROUTER_MAX_CONCURRENCY", "16"))
+ROUTER_RATE_PER_SECOND = float(os.getenv("ROUTER_RATE_PER_SECOND", "0"))  # صفر یعنی بدون محدودیت نرخ
+ROUTER_QUEUE_TIMEOUT = float(os.getenv("ROUTER_QUEUE_TIMEOUT", "10"))
+ROUTER_FIRST_TOKEN_TIMEOUT = float(os.getenv("ROUTER_FIRST_TOKEN_TIMEOUT", "30"))
+ROUTER_HEDGE_AFTER_MS = float(os.getenv("ROUTER_HEDGE_AFTER_MS", "0"))  # صفر یعنی hedging خاموش
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "5"))
+ROUTER_RESET_SECONDS = float(os.getenv("ROUTER_RESET_SECONDS", "30"))
+
+ROUTER_ATTEMPTS = telemetry.register(telemetry.Counter(
+    "llm_router_attempts_total", "Provider attempts made by the router, by outcome.", ("provider", "outcome")))
+
+
+class ProviderUnavailable(ConnectionError):
+    """ارائه‌دهنده در این لحظه درخواست نمی‌پذیرد (مدار باز، صف پر یا سقف نرخ)."""
+
+
+class TokenBucket:
+    """سقف نرخ درخواست؛ هر درخواست یک ژتون رزرو می‌کند و اگر انتظار از max_wait بیشتر شود رد می‌شود."""
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self, max_wait: float):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = (1 - self.tokens) / self.rate
+        if wait > max_wait: raise ProviderUnavailable("سقف نرخ درخواست ارائه‌دهنده پر است")
+        self.tokens -= 1
+        if wait > 0: await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    پس از failure_threshold خطای پیاپی مدار باز می‌شود و تا reset_timeout درخواستی فرستاده نمی‌شود؛
+    سپس یک درخواست آزمایشی (half-open) اجازه دارد و نتیجه آن مدار را می‌بندد یا دوباره باز می‌کند.
+    """
+    def __init__(self, name: str, failure_threshold: int = ROUTER_FAILURE_THRESHOLD, reset_timeout: float = ROUTER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed": return True
+        if state == "open" or self.probing: return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None: print(f"✅ مدار ارائه‌دهنده '{self.name}' دوباره بسته شد.")
+        self.failures, self.opened_at, self.probing = 0, None, False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None: print(f"⚠️ مدار ارائه‌دهنده '{self.name}' پس از {self.failures} خطا باز شد.")
+            self.opened_at, self.probing = time.monotonic(), False
+
+
+def _per_provider(setting: str, name: str, default: float) -> float:
+    """مقدار <setting>_<NAME> (مثلاً ROUTER_RATE_PER_SECOND_GEMINI) اگر تنظیم شده باشد، وگرنه مقدار عمومی."""
+    value = os.getenv(f"{setting}_{name.upper()}")
+    return float(value) if value else default
+
+
+class _Route:
+    def __init__(self, name: str, provider: LLMProvider, max_concurrency: int, rate: float):
+        self.name = name
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self.breaker = CircuitBreaker(name)
+        # ارائه‌دهنده‌ای که در راه‌اندازی در دسترس نبود با مدار باز شروع می‌شود و در حالت half-open دوباره ساخته می‌شود
+        if provider is None: self.breaker.failures, self.breaker.opened_at = 1, time.monotonic()
+
+    async def acquire(self, timeout: float):
+        await asyncio.wait_for(self.semaphore.acquire(), timeout)
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+
+class _Stream:
+    """
+    جریان یک ارائه‌دهنده که اولین تکه‌اش رسیده است؛ جایگاه semaphore تا پایان جریان نگه داشته می‌شود.
+    first_chunk برابر None یعنی ارائه‌دهنده بدون هیچ توکنی (مثلاً با فیلتر ایمنی) به‌درستی تمام کرده است.
+    """
+    def __init__(self, route: _Route, iterator, first_chunk: str):
+        self.route, self.iterator, self.first_chunk = route, iterator, first_chunk
+
+    async def close(self):
+        try:
+            await self.iterator.aclose()
+        finally:
+            self.route.release()
+
+
+class RouterProvider(LLMProvider):
+    """
+    چند ارائه‌دهنده را به ترتیب اولویت پوشش می‌دهد. تا پیش از رسیدن اولین توکن، خطا یا کندی یک ارائه‌دهنده
+    به ارائه‌دهنده بعدی منتقل می‌شود؛ پس از آن جریان به همان ارائه‌دهنده متعهد است.
+    embedding همیشه از ارائه‌دهنده اصلی (اولی) است چون ایندکس FAISS با مدل embedding آن ساخته شده است.
+    به جای ارائه‌دهنده‌های غیر اصلی می‌توان None داد؛ factory(name) آن‌ها را هنگام آزمایش مدار دوباره می‌سازد.
+    """
+    def __init__(self, providers: list[tuple[str, LLMProvider]], max_concurrency: int = ROUTER_MAX_CONCURRENCY,
+                 rate_per_second: float = ROUTER_RATE_PER_SECOND, queue_timeout: float = ROUTER_QUEUE_TIMEOUT,
+                 first_token_timeout: float = ROUTER_FIRST_TOKEN_TIMEOUT, hedge_after_ms: float = ROUTER_HEDGE_AFTER_MS,
+                 factory=None):
+        if not providers or providers[0][1] is None: raise ValueError("ارائه‌دهنده اصلی (embedding) لازم است.")
+        if factory is None and any(provider is None for _, provider in providers):
+            raise ValueError("برای ارائه‌دهنده‌های راه‌اندازی‌نشده factory لازم است.")
+        self.factory = factory
+        self.routes = [_Route(name, provider, int(_per_provider("ROUTER_MAX_CONCURRENCY", name, max_concurrency)),
+                              _per_provider("ROUTER_RATE_PER_SECOND", name, rate_per_second))
+                       for name, provider in providers]
+        self.primary = self.routes[0].provider
+        self.queue_timeout = queue_timeout
+        self.first_token_timeout = first_token_timeout
+        self.hedge_after = hedge_after_ms / 1000
+        self.embedding_model = self.primary.embedding_model
+
+    @property
+    def name(self) -> str:
+        return ",".join(route.name for route in self.routes)
+
+    def status(self) -> list[dict]:
+        return [{"provider": r.name, "circuit": r.breaker.state, "failures": r.breaker.failures, "initialized": r.provider is not None,
+                 "in_flight": r.in_flight, "max_concurrency": r.max_concurrency} for r in self.routes]
+
+    def _build(self, route: _Route):
+        """ارائه‌دهنده‌ای را که در راه‌اندازی در دسترس نبود دوباره می‌سازد؛ فقط در درخواست آزمایشی مدار فراخوانی می‌شود."""
+        try:
+            route.provider = self.factory(route.name)
+        except Exception as e:
+            route.breaker.record_failure()
+            raise ProviderUnavailable(f"ارائه‌دهنده '{route.name}' راه‌اندازی نشد: {e}") from e
+        print(f"✅ ارائه‌دهنده '{route.name}' راه‌اندازی شد.")
+
+    # --- تولید متن ---
+    async def _open(self, route: _Route, messages: list) -> _Stream:
+        """جایگاه هم‌زمانی و ژتون نرخ را می‌گیرد و تا رسیدن اولین تکه منتظر می‌ماند."""
+        if not route.breaker.allow(): raise ProviderUnavailable(f"مدار '{route.name}' باز است")
+        if route.provider is None:
+            try:
+                await asyncio.to_thread(self._build, route)
+            except asyncio.CancelledError:
+                route.breaker.probing = False
+                raise
+        try:
+            await route.acquire(self.queue_timeout)
+        except asyncio.TimeoutError:
+            route.breaker.probing = False
+            raise ProviderUnavailable(f"صف '{route.name}' پر است")
+        iterator = None
+        try:
+            if route.bucket: await route.bucket.acquire(self.queue_timeout)
+            iterator = route.provider.agenerate_stream(messages)
+            first_chunk = await asyncio.wait_for(anext(iterator), self.first_token_timeout)
+        except StopAsyncIteration:
+            # پاسخ خالی خطا نیست: مدار را باز نمی‌کند و failover هم انجام نمی‌شود (مانند مسیر هم‌گام)
+            first_chunk = None
+        except BaseException as e:
+            if iterator is not None: await iterator.aclose()
+            route.release()
+            if isinstance(e, (asyncio.CancelledError, ProviderUnavailable)):
+                route.breaker.probing = False
+            else:
+                route.breaker.record_failure()
+                telemetry.LLM_ERRORS.inc(1, route.name)
+            raise
+        route.breaker.record_success()
+        return _Stream(route, iterator, first_chunk)
+
+    async def _first_stream(self, messages: list) -> _Stream:
+        """
+        ارائه‌دهنده‌ها را به ترتیب امتحان می‌کند. با hedging، اگر اولین توکن تا hedge_after نرسد
+        ارائه‌دهنده بعدی هم شروع می‌شود و هر کدام زودتر پاسخ دهد برنده است.
+        """
+        candidates = iter(self.routes)
+        pending = {}
+        errors = []
+
+        def launch() -> bool:
+            route = next(candidates, None)
+            if route is None: return False
+            pending[asyncio.create_task(self._open(route, messages))] = route
+            return True
+
+        launch()
+        hedge = self.hedge_after > 0
+        winner = None
+        try:
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after if hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    ROUTER_ATTEMPTS.inc(1, pending[next(iter(pending))].name, "hedged")
+                    hedge = launch()
+                    continue
+                for task in done:
+                    route = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append(f"{route.name}: {task.exception()}")
+                        ROUTER_ATTEMPTS.inc(1, route.name, "unavailable" if isinstance(task.exception(), ProviderUnavailable) else "failed")
+                    elif winner is None:
+                        winner = task.result()
+                        ROUTER_ATTEMPTS.inc(1, route.name, "served")
+                    else:
+                        await task.result().close()
+                if winner is None and not pending: launch()
+        finally:
+            for task in pending: task.cancel()
+            for task in pending:
+                try:
+                    stream = await task
+                    await stream.close()
+                except BaseException:
+                    pass
+                ROUTER_ATTEMPTS.inc(1, pending[task].name, "cancelled")
+        if winner is None: raise ProviderUnavailable("هیچ ارائه‌دهنده‌ای پاسخ نداد: " + "; ".join(errors))
+        return winner
+
+    @staticmethod
+    async def _chunks(stream: _Stream):
+        if stream.first_chunk is None: return
+        yield stream.first_chunk
+        async for chunk in stream.iterator:
+            yield chunk
+
+    async def agenerate_stream(self, messages: list):
+        start = time.perf_counter()
+        stream = await self._first_stream(messages)
+        route = stream.route
+        # TTFT (از ابتدای درخواست، شامل failover و hedging)، سرعت و خطای جریان به نام ارائه‌دهنده‌ای ثبت می‌شود که آن را سرو کرده است
+        chunks = telemetry.instrument_stream(self._chunks(stream), route.name, route.provider.count_tokens, start=start)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception:
+            route.breaker.record_failure()
+            raise
+        finally:
+            await chunks.aclose()
+            await stream.close()
+
+    def generate_stream(self, messages: list):
+        # مسیر هم‌گام فقط failover ساده دارد؛ مسیر سرویس از agenerate_stream استفاده می‌کند
+        errors = []
+        for route in self.routes:
+            if not route.breaker.allow(): continue
+            if route.provider is None:
+                try:
+                    self._build(route)
+                except ProviderUnavailable as e:
+                    errors.append(str(e)); continue
+            iterator = iter(route.provider.generate_stream(messages))
+            try:
+                first_chunk = next(iterator)
+            except StopIteration:
+                route.breaker.record_success()
+                return
+            except Exception as e:
+                route.breaker.record_failure()
+                errors.append(f"{route.name}: {e}")
+                continue
+            route.breaker.record_success()
+            yield first_chunk
+            yield from iterator
+            return
+        raise ProviderUnavailable("هیچ ارائه‌دهنده‌ای پاسخ نداد: " + "; ".join(errors))
+
+    def count_tokens(self, text: str) -> int:
+        return self.primary.count_tokens(text)
+
+    # --- embedding: همیشه ارائه‌دهنده اصلی ---
+    def _embed_query(self, text: str) -> list[float]:
+        return self.primary._embed_query(text)
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return self.primary._embed_batch(texts)
+
+    def embedding_signature(self) -> dict:
+        return self.primary.embedding_signature()
+
+    def create_embedding(self, text: str) -> list[float]:
+        return self.primary.create_embedding(text)
+
+    async def acreate_embedding(self, text: str) -> list[float]:
+        return await self.primary.acreate_embedding(text)
+
+    def create_document_embeddings(self, chunks: list[str]):
+        return self.primary.create_document_embeddings(chunks)
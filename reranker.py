@@ -0,0 +1,75 @@
+# reranker.py - مرتب‌سازی دوباره نامزدهای بازیابی با یک مدل cross-encoder محلی (ONNX روی CPU)
+import os
+import time
+import numpy as np
+
+try:
+    # وابستگی‌های اختیاری؛ بدون آن‌ها مرحله rerank غیرفعال می‌ماند
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+except ImportError:
+    ort = Tokenizer = None
+
+
+class CrossEncoderReranker:
+    """
+    جفت (پرسش، تکه) را با یک cross-encoder در قالب ONNX (ترجیحاً کوانتیزه int8) امتیاز می‌دهد.
+    پوشه مدل باید model.onnx و tokenizer.json داشته باشد. امتیازدهی دسته‌ای و با مهلت deadline_ms انجام می‌شود:
+    اگر دسته بعدی در مهلت جا نشود، rerank لغو و ترتیب ادغام (RRF) حفظ می‌شود.
+    """
+    def __init__(self, model_path: str, top_n: int = None, deadline_ms: float = None, batch_size: int = None,
+                 max_length: int = None, threads: int = None):
+        if ort is None or Tokenizer is None:
+            raise ImportError("برای rerank بسته‌های onnxruntime و tokenizers لازم است (pip install onnxruntime tokenizers).")
+        self.top_n = top_n or int(os.getenv("RERANK_TOP_N", "20"))
+        self.deadline_ms = deadline_ms or float(os.getenv("RERANK_DEADLINE_MS", "150"))
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "8"))
+        max_length = max_length or int(os.getenv("RERANK_MAX_LENGTH", "256"))
+        threads = threads or int(os.getenv("RERANK_THREADS", "0"))
+        self.timeouts = self.calls = 0
+
+        model_file = model_path if model_path.endswith(".onnx") else os.path.join(model_path, "model.onnx")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads: options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(model_file), "tokenizer.json"))
+        # فقط متن تکه کوتاه می‌شود تا پرسش همیشه کامل دیده شود؛ padding تا بلندترین عضو دسته
+        self.tokenizer.enable_truncation(max_length, strategy="only_second")
+        self.tokenizer.enable_padding()
+
+    def score(self, query: str, passages: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch([(query, passage) for passage in passages])
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {name: value for name, value in feed.items() if name in self.input_names})[0]
+        # خروجی یک ستونی (امتیاز) یا دو ستونی (نامرتبط/مرتبط)
+        return logits[:, -1] if logits.ndim == 2 else logits
+
+    def rerank(self, query: str, passages: list[str]) -> list[int] | None:
+        """ترتیب جدید اندیس‌های passages را برمی‌گرداند؛ None اگر امتیازدهی در مهلت تمام نشود."""
+        self.calls += 1
+        start = time.perf_counter()
+        deadline = start + self.deadline_ms / 1000
+        scores, batch_seconds = [], 0.0
+        for begin in range(0, len(passages), self.batch_size):
+            batch_start = time.perf_counter()
+            # دسته‌ای که پیش‌بینی می‌شود از مهلت بگذرد اجرا نمی‌شود
+            if batch_start + batch_seconds > deadline:
+                self.timeouts += 1
+                return None
+            scores.extend(self.score(query, passages[begin:begin + self.batch_size]).tolist())
+            batch_seconds = time.perf_counter() - batch_start
+        return sorted(range(len(passages)), key=lambda i: -scores[i])
+
+
+def load_reranker():
+    """reranker را از RERANK_MODEL_PATH می‌سازد؛ None اگر تنظیم نشده باشد."""
+    model_path = os.getenv("RERANK_MODEL_PATH")
+    if not model_path: return None
+    return CrossEncoderReranker(model_path)
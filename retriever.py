@@ -0,0 +1,123 @@
+# retriever.py - موتور بازیابی ترکیبی (FAISS + BM25) با ادغام RRF
+import os
+import time
+import asyncio
+from dataclasses import dataclass, field
+import vector_index
+import persian_text
+
+
+@dataclass
+class RetrievalResult:
+    context: str = ""
+    chunk_ids: list = field(default_factory=list)
+    # متن قالب‌بندی شده هر تکه به ترتیب رتبه (برای بودجه‌بندی توکن در context_builder)
+    chunks: list = field(default_factory=list)
+    # True اگر ترتیب نهایی از reranker آمده باشد (نه ادغام RRF)
+    reranked: bool = False
+    timings: dict = field(default_factory=dict)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.timings.values())
+
+
+class HybridRetriever:
+    """پرسش را با FAISS و BM25 جستجو کرده و نتایج را با Reciprocal Rank Fusion ادغام می‌کند."""
+    def __init__(self, llm_provider, index, chunks: list[str], bm25_index,
+                 top_k: int = None, candidates: int = None, rrf_k: int = None, reranker=None):
+        self.llm_provider = llm_provider
+        self.index = index
+        self.chunks = chunks
+        self.bm25 = bm25_index
+        # پرسش دقیقاً با همان توکن‌سازی اسناد ایندکس توکن می‌شود
+        self.tokenize = persian_text.tokenizer_for(getattr(bm25_index, "tokenizer", None)) or persian_text.tokenize
+        self.top_k = top_k or int(os.getenv("RETRIEVAL_TOP_K", "5"))
+        self.candidates = candidates or int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+        self.rrf_k = rrf_k or int(os.getenv("RRF_K", "60"))
+        # reranker اختیاری (reranker.CrossEncoderReranker) روی top_n نامزد اول ادغام اجرا می‌شود
+        self.reranker = reranker
+
+    def _vector_search(self, query_vector, timings: dict) -> list[int]:
+        if self.index is None or query_vector is None: return []
+        start = time.perf_counter()
+        _, ids = self.index.search(vector_index.prepare_query(self.index, query_vector), min(self.candidates, self.index.ntotal))
+        timings["faiss_ms"] = (time.perf_counter() - start) * 1000
+        return [int(i) for i in ids[0] if i >= 0]
+
+    def _keyword_search(self, query: str, timings: dict) -> list[int]:
+        if self.bm25 is None: return []
+        start = time.perf_counter()
+        doc_ids, scores = self.bm25.search(self.tokenize(query), self.candidates)
+        ranked = [int(doc_id) for doc_id, score in zip(doc_ids, scores) if score > 0]
+        timings["bm25_ms"] = (time.perf_counter() - start) * 1000
+        return ranked
+
+    @staticmethod
+    def _chunk_text(record) -> str:
+        return record if isinstance(record, str) else record["text"]
+
+    @staticmethod
+    def _format_chunk(record) -> str:
+        # خروجی‌های قدیمی ingest فقط متن تکه را نگه می‌داشتند
+        if isinstance(record, str): return record
+        return f"(منبع: {record['source']}، صفحه {record['page']})\n{record['text']}"
+
+    def _fuse(self, *rankings: list[int], limit: int) -> list[int]:
+        fused = {}
+        for ranking in rankings:
+            for rank, doc_id in enumerate(ranking):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        return sorted(fused, key=fused.get, reverse=True)[:limit]
+
+    def _candidates(self, query: str, query_vector, result: RetrievalResult) -> list[int]:
+        vector_ids = self._vector_search(query_vector, result.timings)
+        keyword_ids = self._keyword_search(query, result.timings)
+
+        start = time.perf_counter()
+        limit = max(self.top_k, self.reranker.top_n) if self.reranker else self.top_k
+        candidate_ids = self._fuse(vector_ids, keyword_ids, limit=limit)
+        result.timings["fusion_ms"] = (time.perf_counter() - start) * 1000
+        return candidate_ids
+
+    def _rerank(self, query: str, candidate_ids: list[int], result: RetrievalResult) -> list[int]:
+        if self.reranker is None or len(candidate_ids) < 2: return candidate_ids[:self.top_k]
+        start = time.perf_counter()
+        order = self.reranker.rerank(query, [self._chunk_text(self.chunks[doc_id]) for doc_id in candidate_ids])
+        result.timings["rerank_ms"] = (time.perf_counter() - start) * 1000
+        # در صورت گذشتن از مهلت، ترتیب ادغام بدون تغییر استفاده می‌شود
+        if order is None: return candidate_ids[:self.top_k]
+        result.reranked = True
+        return [candidate_ids[i] for i in order[:self.top_k]]
+
+    def _finish(self, chunk_ids: list[int], result: RetrievalResult) -> RetrievalResult:
+        result.chunk_ids = chunk_ids
+        result.chunks = [f"[{i + 1}] {self._format_chunk(self.chunks[doc_id])}" for i, doc_id in enumerate(chunk_ids)]
+        result.context = "\n\n".join(result.chunks)
+        return result
+
+    def retrieve(self, query: str, query_vector=None) -> RetrievalResult:
+        result = RetrievalResult()
+        if not self.chunks: return result
+        if self.index is not None and query_vector is None:
+            start = time.perf_counter()
+            query_vector = self.llm_provider.create_embedding(query)
+            result.timings["embedding_ms"] = (time.perf_counter() - start) * 1000
+        candidate_ids = self._candidates(query, query_vector, result)
+        return self._finish(self._rerank(query, candidate_ids, result), result)
+
+    async def aretrieve(self, query: str, query_vector=None) -> RetrievalResult:
+        """
+        مانند retrieve، اما embedding پرسش بدون مسدود کردن حلقه رویداد ساخته می‌شود.
+        اگر فراخواننده embedding پرسش را از قبل دارد (مثلاً برای کش معنایی) می‌تواند آن را بدهد.
+        """
+        result = RetrievalResult()
+        if not self.chunks: return result
+        if self.index is not None and query_vector is None:
+            start = time.perf_counter()
+            query_vector = await self.llm_provider.acreate_embedding(query)
+            result.timings["embedding_ms"] = (time.perf_counter() - start) * 1000
+        candidate_ids = self._candidates(query, query_vector, result)
+        if self.reranker is None: return self._finish(candidate_ids, result)
+        # استنتاج مدل rerank روی CPU در نخ جدا انجام می‌شود تا حلقه رویداد آزاد بماند
+        return self._finish(await asyncio.to_thread(self._rerank, query, candidate_ids, result), result)
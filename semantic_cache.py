@@ -0,0 +1,108 @@
+# semantic_cache.py - کش معنایی پاسخ‌ها برای پرسش‌های تکراری معلمان هم‌پروفایل
+import os
+import time
+from collections import OrderedDict
+import faiss
+import numpy as np
+import vector_index
+import telemetry
+
+LOOKUPS = telemetry.register(telemetry.Counter(
+    "semantic_cache_lookups_total", "Semantic answer cache lookups, by result.", ("result",)))
+REMOVALS = telemetry.register(telemetry.Counter(
+    "semantic_cache_removals_total", "Answers dropped from the semantic cache, by reason.", ("reason",)))
+ENTRIES = telemetry.register(telemetry.Gauge("semantic_cache_entries", "Answers currently held in the semantic cache."))
+
+
+class _Bucket:
+    """یک ایندکس تخت ضرب داخلی (روی بردارهای نرمال شده، یعنی شباهت کسینوسی) به همراه پاسخ‌ها به ترتیب LRU."""
+    def __init__(self, dim: int):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries = OrderedDict()  # id -> (answer, created_at)
+
+    def remove(self, entry_ids: list[int]):
+        self.index.remove_ids(np.asarray(entry_ids, dtype=np.int64))
+        for entry_id in entry_ids: self.entries.pop(entry_id, None)
+
+
+class SemanticCache:
+    """
+    پاسخ‌ها بر اساس embedding پرسش و در بخش جداگانه برای هر پروفایل (prompt_manager.profile_bucket) نگه داشته می‌شوند.
+    اگر شبیه‌ترین پرسش ذخیره‌شده دست‌کم threshold شباهت داشته باشد و عمرش از ttl نگذشته باشد، پاسخ آن برگردانده می‌شود.
+    هر بخش حداکثر max_entries پاسخ دارد و کم‌استفاده‌ترین‌ها حذف می‌شوند. با تغییر نسخه پایگاه دانش همه چیز پاک می‌شود.
+    """
+    def __init__(self, threshold: float = None, ttl: float = None, max_entries: int = None):
+        self.threshold = threshold if threshold is not None else float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+        self.kb_version = None
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._buckets = {}
+        self._next_id = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def set_kb_version(self, version):
+        """نسخه پایگاه دانش را ثبت می‌کند؛ اگر تغییر کرده باشد پاسخ‌های قبلی دیگر معتبر نیستند."""
+        if version != self.kb_version: self.clear()
+        self.kb_version = version
+
+    def clear(self):
+        self._buckets.clear()
+        ENTRIES.set(0)
+
+    def _miss(self):
+        self.misses += 1
+        LOOKUPS.inc(1, "miss")
+
+    @staticmethod
+    def _prepare(query_vector) -> np.ndarray:
+        return vector_index.normalize(np.array(query_vector, dtype=np.float32).reshape(1, -1))
+
+    def lookup(self, bucket_key, query_vector) -> str | None:
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None or bucket.index.ntotal == 0:
+            self._miss()
+            return None
+        scores, ids = bucket.index.search(self._prepare(query_vector), 1)
+        entry_id, score = int(ids[0][0]), float(scores[0][0])
+        if entry_id < 0 or score < self.threshold:
+            self._miss()
+            return None
+        answer, created_at = bucket.entries[entry_id]
+        if time.time() - created_at > self.ttl:
+            bucket.remove([entry_id]); self.expirations += 1
+            REMOVALS.inc(1, "expired"); ENTRIES.set(self._entry_count())
+            self._miss()
+            return None
+        bucket.entries.move_to_end(entry_id)
+        self.hits += 1
+        LOOKUPS.inc(1, "hit")
+        return answer
+
+    def store(self, bucket_key, query_vector, answer: str):
+        if not self.enabled or not answer: return
+        vector = self._prepare(query_vector)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None or bucket.index.d != vector.shape[1]:
+            bucket = self._buckets[bucket_key] = _Bucket(vector.shape[1])
+        entry_id, self._next_id = self._next_id, self._next_id + 1
+        bucket.index.add_with_ids(vector, np.asarray([entry_id], dtype=np.int64))
+        bucket.entries[entry_id] = (answer, time.time())
+        if len(bucket.entries) > self.max_entries:
+            overflow = list(bucket.entries)[:len(bucket.entries) - self.max_entries]
+            bucket.remove(overflow); self.evictions += len(overflow)
+            REMOVALS.inc(len(overflow), "evicted")
+        ENTRIES.set(self._entry_count())
+
+    def _entry_count(self) -> int:
+        return sum(len(b.entries) for b in self._buckets.values())
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions, "expirations": self.expirations, "buckets": len(self._buckets),
+                "entries": self._entry_count(), "kb_version": self.kb_version}
+
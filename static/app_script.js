@@ -19,11 +19,12 @@ document.addEventListener('DOMContentLoaded', async () => {
     // --- Application State ---
     let activeConversationId = null;
     const userInfo = JSON.parse(localStorage.getItem('userInfo'));
-    let currentPage = 1;
+    const sessionToken = localStorage.getItem('sessionToken');
+    let oldestMessageId = null;
     let isLoadingMessages = false;
     let hasMoreMessages = true;
 
-    if (!userInfo) {
+    if (!userInfo || !sessionToken) {
         window.location.href = '/';
         return;
     }
@@ -49,15 +50,27 @@ document.addEventListener('DOMContentLoaded', async () => {
     if (overlay) overlay.addEventListener('click', closeSidebar);
 
     // --- Logout Logic ---
-    logoutBtn.addEventListener('click', () => {
+    const logout = () => {
         localStorage.removeItem('userInfo');
+        localStorage.removeItem('sessionToken');
         window.location.href = '/';
-    });
+    };
+    logoutBtn.addEventListener('click', logout);
+
+    // --- API requests carry the session token; an expired session returns to the login page ---
+    const apiFetch = async (url, options = {}) => {
+        const response = await fetch(url, {
+            ...options,
+            headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${sessionToken}`, ...options.headers }
+        });
+        if (response.status === 401) logout();
+        return response;
+    };
 
     // --- Conversation Management ---
     const loadConversations = async () => {
         try {
-            const response = await fetch(`/api/conversations/${userInfo.id}`);
+            const response = await apiFetch('/api/conversations');
             const conversations = await response.json();
             conversationList.innerHTML = '';
             conversations.forEach(conv => {
@@ -86,11 +99,7 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     const deleteConversation = async (convId) => {
         try {
-            await fetch(`/api/conversations/${convId}`, {
-                method: 'DELETE',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ user_id: userInfo.id })
-            });
+            await apiFetch(`/api/conversations/${convId}`, { method: 'DELETE' });
             if (convId === activeConversationId) newChatBtn.click();
             await loadConversations();
         } catch (error) { console.error('Error deleting conversation:', error); }
@@ -99,7 +108,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     const setActiveConversation = async (convId) => {
         activeConversationId = convId;
         chatWindow.innerHTML = '';
-        currentPage = 1;
+        oldestMessageId = null;
         hasMoreMessages = true;
         document.querySelectorAll('.conversation-item').forEach(item => {
             item.classList.remove('active');
@@ -114,19 +123,21 @@ document.addEventListener('DOMContentLoaded', async () => {
         isLoadingMessages = true;
         loadingSpinner.classList.remove('hidden');
         try {
-            const response = await fetch(`/api/messages/${activeConversationId}?page=${currentPage}&limit=20`);
+            const cursor = oldestMessageId ? `&before_id=${oldestMessageId}` : '';
+            const response = await apiFetch(`/api/messages/${activeConversationId}?limit=20${cursor}`);
             const messages = await response.json();
             if (messages.length < 20) { hasMoreMessages = false; }
+            const isFirstPage = oldestMessageId === null;
+            if (messages.length > 0) { oldestMessageId = messages[0].id; }
             const oldScrollHeight = chatWindow.scrollHeight;
             messages.forEach(msg => {
                 appendMessage(msg.content, msg.role === 'model' ? 'assistant' : 'user', false, msg.id, true);
             });
-            if (currentPage > 1) {
+            if (!isFirstPage) {
                 chatWindowWrapper.scrollTop = chatWindow.scrollHeight - oldScrollHeight;
             } else {
                 chatWindowWrapper.scrollTop = chatWindow.scrollHeight;
             }
-            currentPage++;
         } catch (error) {
             console.error('Error loading more messages:', error);
         } finally {
@@ -142,7 +153,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     newChatBtn.addEventListener('click', () => {
         activeConversationId = null;
         chatWindow.innerHTML = '';
-        currentPage = 1;
+        oldestMessageId = null;
         hasMoreMessages = true;
         document.querySelectorAll('.conversation-item').forEach(item => item.classList.remove('active'));
         appendMessage('سلام! لطفاً اولین پیام خود را برای شروع یک گفتگوی جدید ارسال کنید.', 'assistant');
@@ -158,10 +169,9 @@ document.addEventListener('DOMContentLoaded', async () => {
         let convIdToUse = activeConversationId;
         if (!convIdToUse) {
             try {
-                const response = await fetch('/api/start_conversation', {
+                const response = await apiFetch('/api/start_conversation', {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ user_id: userInfo.id, first_message: messageText })
+                    body: JSON.stringify({ first_message: messageText })
                 });
                 const data = await response.json();
                 convIdToUse = data.conversation_id;
@@ -171,9 +181,8 @@ document.addEventListener('DOMContentLoaded', async () => {
         }
         const assistantMessageWrapper = appendMessage('', 'assistant', true);
         try {
-            const response = await fetch('/api/chat', {
+            const response = await apiFetch('/api/chat', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ conversation_id: convIdToUse, message: messageText })
             });
             const assistantMessageDiv = assistantMessageWrapper.querySelector('.message');
@@ -252,10 +261,9 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     async function sendFeedback(messageId, rating, buttonElement) {
         try {
-            await fetch('/api/feedback', {
+            await apiFetch('/api/feedback', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ message_id: messageId, user_id: userInfo.id, rating })
+                body: JSON.stringify({ message_id: messageId, rating })
             });
             buttonElement.classList.toggle('selected');
         } catch (error) {
@@ -74,6 +74,7 @@ document.addEventListener('DOMContentLoaded', () => {
             if (response.ok) {
                 // ذخیره اطلاعات کاربر در حافظه مرورگر
                 localStorage.setItem('userInfo', JSON.stringify(data.user));
+                localStorage.setItem('sessionToken', data.token);
                 // انتقال به صفحه اصلی اپلیکیشن
                 window.location.href = '/app.html';
             } else {
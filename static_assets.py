@@ -0,0 +1,118 @@
+# static_assets.py - سرو فایل‌های static از حافظه با نسخه‌های gzip/brotli از پیش فشرده، ETag محتوایی و کش immutable
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from dataclasses import dataclass, field
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli  # اختیاری: اگر نصب نباشد فقط gzip ساخته می‌شود
+except ImportError:
+    brotli = None
+
+# فونت‌های woff2 و تصاویر از قبل فشرده‌اند؛ فقط متن فشرده می‌شود
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+COMPRESS_MIN_BYTES = 512
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+# صفحه‌ها و آدرس‌های بدون نسخه هر بار با ETag بازبینی می‌شوند (پاسخ 304 بدون بدنه)
+REVALIDATE_CACHE = "no-cache"
+
+_STATIC_REF = re.compile(r"/static/([\w./-]+)")
+
+
+@dataclass
+class Asset:
+    content_type: str
+    version: str
+    bodies: dict = field(default_factory=dict)  # encoding ("identity"، "gzip"، "br") -> bytes
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.version}"' if encoding == "identity" else f'"{self.version}-{encoding}"'
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """سرآیند Accept-Encoding را به نگاشت coding -> q تبدیل می‌کند؛ q نامعتبر صفر در نظر گرفته می‌شود."""
+    codings = {}
+    for part in header.split(","):
+        coding, *params = (item.strip() for item in part.split(";"))
+        if not coding: continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding.lower()] = q
+    return codings
+
+
+class StaticAssets:
+    """
+    همه فایل‌های پوشه را یک بار در راه‌اندازی می‌خواند. ارجاع‌های /static/... درون CSS و HTML به آدرس
+    نسخه‌دار (?v=<hash>) بازنویسی می‌شوند تا مرورگر فایل‌های نسخه‌دار را بدون درخواست دوباره از کش بخواند.
+    """
+    def __init__(self, directory: str = "static", prefix: str = "/static/"):
+        self.directory = directory
+        self.prefix = prefix
+        self.assets = {}
+        files = sorted(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/")
+                       for root, _, names in os.walk(directory) for name in names)
+        # فایل‌هایی که به بقیه ارجاع می‌دهند آخر ساخته می‌شوند تا هش ارجاع‌شونده‌ها آماده باشد
+        order = {".css": 1, ".html": 2}
+        for path in sorted(files, key=lambda p: order.get(os.path.splitext(p)[1], 0)):
+            with open(os.path.join(directory, path), "rb") as f: data = f.read()
+            content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+                content_type += "; charset=utf-8"
+            if path.endswith((".css", ".html")): data = self._fingerprint_refs(data)
+            self.assets[path] = self._build(content_type, data)
+
+    def _fingerprint_refs(self, data: bytes) -> bytes:
+        def replace(match):
+            asset = self.assets.get(match.group(1))
+            return self.url(match.group(1)) if asset else match.group(0)
+        return _STATIC_REF.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+    @staticmethod
+    def _build(content_type: str, data: bytes) -> Asset:
+        asset = Asset(content_type, hashlib.sha256(data).hexdigest()[:16], {"identity": data})
+        if len(data) >= COMPRESS_MIN_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+            variants = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None: variants["br"] = brotli.compress(data, quality=11)
+            asset.bodies.update({enc: body for enc, body in variants.items() if len(body) < len(data)})
+        return asset
+
+    def url(self, path: str) -> str:
+        return f"{self.prefix}{path}?v={self.assets[path].version}"
+
+    def stats(self) -> dict:
+        """حجم کل ارسالی برای هر encoding ساخته‌شده (فایل‌های بدون آن نسخه با identity حساب می‌شوند)."""
+        built = [enc for enc in ("identity", "gzip", "br") if any(enc in a.bodies for a in self.assets.values())]
+        return {"files": len(self.assets),
+                "bytes": {enc: sum(len(a.bodies.get(enc, a.bodies["identity"])) for a in self.assets.values())
+                          for enc in built}}
+
+    def response(self, request: Request, path: str) -> Response:
+        asset = self.assets.get(path)
+        if asset is None: return Response(status_code=404)
+        accepted = parse_accept_encoding(request.headers.get("accept-encoding", ""))
+        # بالاترین q برنده است و در تساوی br بر gzip مقدم است؛ q=0 یعنی مرورگر آن را نمی‌پذیرد
+        weights = {enc: accepted.get(enc, accepted.get("*", 0.0)) for enc in ("br", "gzip") if enc in asset.bodies}
+        encoding = max((enc for enc in weights if weights[enc] > 0), key=lambda enc: weights[enc], default="identity")
+        versioned = request.query_params.get("v") == asset.version
+        headers = {"ETag": asset.etag(encoding), "Vary": "Accept-Encoding",
+                   "Cache-Control": IMMUTABLE_CACHE if versioned else REVALIDATE_CACHE}
+        if encoding != "identity": headers["Content-Encoding"] = encoding
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match == "*" or any(tag.strip().removeprefix("W/") in {asset.etag(enc) for enc in asset.bodies}
+                                       for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+        body = asset.bodies[encoding]
+        if request.method == "HEAD":
+            return Response(headers={**headers, "Content-Length": str(len(body))}, media_type=asset.content_type)
+        return Response(body, media_type=asset.content_type, headers=headers)
@@ -0,0 +1,211 @@
+# telemetry.py - شناسه ردیابی هر درخواست، زمان‌سنجی مراحل و متریک‌های Prometheus (هیستوگرام و شمارنده)
+import os
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+ENABLED = os.getenv("TELEMETRY_ENABLED", "1") != "0"
+
+# مرزهای پیش‌فرض هیستوگرام‌های زمانی (ثانیه)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, tuple(buckets)
+        self._series = {}  # مقادیر برچسب -> [شمارش هر سطل..., مجموع, تعداد]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        if not ENABLED: return
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None: series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if value <= self.buckets[-1]: series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                base = "".join(f'{k}="{v}",' for k, v in zip(self.labels, label_values))
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{base}le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{base}le="+Inf"}} {series[-1]}')
+                suffix = f"{{{base.rstrip(',')}}}" if base else ""
+                lines.append(f"{self.name}_sum{suffix} {series[-2]}")
+                lines.append(f"{self.name}_count{suffix} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        if not ENABLED: return
+        with self._lock: self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+                lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+class Gauge:
+    """مقدار لحظه‌ای (مثل تعداد ردیف‌های یک کش) که با set جایگزین می‌شود."""
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *label_values):
+        if not ENABLED: return
+        with self._lock: self._values[label_values] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+                lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+REGISTRY = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+HTTP_DURATION = register(Histogram("http_request_duration_seconds", "HTTP request duration including the streamed body.",
+                                    ("method", "route", "status")))
+STAGE_DURATION = register(Histogram("chat_stage_duration_seconds", "Duration of each /api/chat pipeline stage.", ("stage",)))
+LLM_TTFT = register(Histogram("llm_time_to_first_token_seconds", "Time from request to first streamed token.", ("provider",)))
+LLM_TOKENS_PER_SECOND = register(Histogram("llm_tokens_per_second", "Output tokens per second after the first token.",
+                                            ("provider",), RATE_BUCKETS))
+LLM_OUTPUT_TOKENS = register(Counter("llm_output_tokens_total", "Streamed output tokens.", ("provider",)))
+LLM_ERRORS = register(Counter("llm_stream_errors_total", "Streams that failed before completing.", ("provider",)))
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# --- ردیابی هر درخواست ---
+class Trace:
+    """زمان مراحل یک درخواست؛ در پایان درخواست یک خط خلاصه در لاگ ثبت می‌شود."""
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.stages = {}
+
+    def record(self, stage: str, seconds: float):
+        if not ENABLED: return
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_DURATION.observe(seconds, stage)
+
+    @contextmanager
+    def stage(self, name: str):
+        if not ENABLED:
+            yield; return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items())
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_NULL_TRACE = Trace("-")
+
+
+def current_trace() -> Trace:
+    """ردیابی درخواست جاری؛ بیرون از درخواست یا در حالت غیرفعال یک شیء بی‌اثر برمی‌گردد."""
+    return _current_trace.get() or _NULL_TRACE
+
+
+class TraceIdFilter(logging.Filter):
+    """شناسه ردیابی درخواست جاری را با نام trace_id در هر رکورد لاگ قرار می‌دهد."""
+    def filter(self, record):
+        record.trace_id = current_trace().trace_id
+        return True
+
+
+async def instrument_stream(stream, provider: str, count_tokens, trace: Trace = None, start: float = None):
+    """
+    ژنراتور async پاسخ مدل را بدون تغییر عبور می‌دهد و زمان تا اولین توکن، توکن در ثانیه
+    و تعداد توکن‌های خروجی را برای ارائه‌دهنده ثبت می‌کند. start (perf_counter) زمان شروع درخواست است
+    وقتی جریان پس از انتخاب ارائه‌دهنده (مثلاً در RouterProvider) پوشش داده می‌شود.
+    """
+    if not ENABLED:
+        async for chunk in stream: yield chunk
+        return
+    trace = trace or current_trace()
+    start = start if start is not None else time.perf_counter()
+    first = None
+    parts = []
+    try:
+        async for chunk in stream:
+            if first is None:
+                first = time.perf_counter()
+                LLM_TTFT.observe(first - start, provider)
+                trace.record("llm_ttft", first - start)
+            parts.append(chunk)
+            yield chunk
+    except Exception:
+        # GeneratorExit (قطع اتصال کاربر) و CancelledError خطای ارائه‌دهنده نیستند و شمرده نمی‌شوند
+        LLM_ERRORS.inc(1, provider)
+        raise
+    end = time.perf_counter()
+    trace.record("llm_stream", end - start)
+    tokens = count_tokens("".join(parts)) if parts else 0
+    LLM_OUTPUT_TOKENS.inc(tokens, provider)
+    if first is not None and end > first: LLM_TOKENS_PER_SECOND.observe(tokens / (end - first), provider)
+
+
+class TelemetryMiddleware:
+    """
+    میان‌افزار ASGI: برای هر درخواست HTTP یک Trace (از سرآیند X-Request-ID یا شناسه تازه) می‌سازد،
+    شناسه را در سرآیند X-Trace-ID برمی‌گرداند و مدت کل پاسخ (تا آخرین بایت جریان) را ثبت می‌کند.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send); return
+        headers = dict(scope.get("headers") or [])
+        trace = Trace(headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16])
+        token = _current_trace.set(trace)
+        status = [500]
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.trace_id.encode("latin-1"))]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_DURATION.observe(time.perf_counter() - start, scope["method"], route, str(status[0]))
+            _current_trace.reset(token)
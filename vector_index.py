@@ -0,0 +1,158 @@
+# vector_index.py - ساخت و تنظیم ایندکس برداری FAISS (Flat / IVF-Flat / HNSW / IVF-PQ)
+import os
+import math
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+
+def normalize(vectors) -> np.ndarray:
+    """بردارها را به float32 پیوسته تبدیل و نرمال (L2) می‌کند تا ضرب داخلی معادل شباهت کسینوسی باشد."""
+    vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    if vectors.ndim == 1: vectors = vectors.reshape(1, -1)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def prepare_query(index, vectors) -> np.ndarray:
+    """بردار پرسش را متناسب با متریک ایندکس آماده می‌کند (ایندکس‌های قدیمی L2 بدون نرمال‌سازی)."""
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return normalize(vectors)
+    return np.ascontiguousarray(np.asarray(vectors, dtype=np.float32)).reshape(1, -1)
+
+
+def _pq_subquantizers(dim: int, requested: int) -> int:
+    # تعداد زیرکوانتایزرها باید بعد بردار را بشمارد
+    return max(m for m in range(1, min(requested, dim) + 1) if dim % m == 0)
+
+
+def build_index(embeddings, index_type: str = None, ids=None, **params):
+    """
+    ایندکس FAISS را بر اساس پیکربندی می‌سازد. همه انواع از ضرب داخلی روی بردارهای نرمال استفاده می‌کنند.
+    اگر ids داده شود، بردارها با همین شناسه‌ها ذخیره می‌شوند تا بعداً قابل حذف یا اضافه باشند
+    (ایندکس‌های IVF خودشان شناسه نگه می‌دارند؛ flat و HNSW در IndexIDMap2 پیچیده می‌شوند).
+    پارامترها (یا متغیرهای محیطی متناظر):
+    - index_type / FAISS_INDEX_TYPE: یکی از flat، ivf_flat، hnsw، ivf_pq
+    - nlist / FAISS_NLIST: تعداد خوشه‌های IVF (پیش‌فرض: 4 * sqrt(n))
+    - hnsw_m / FAISS_HNSW_M و ef_construction / FAISS_HNSW_EF_CONSTRUCTION
+    - pq_m / FAISS_PQ_M و pq_nbits / FAISS_PQ_NBITS
+    """
+    index_type = (index_type or os.getenv("FAISS_INDEX_TYPE", "flat")).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"نوع ایندکس '{index_type}' پشتیبانی نمی‌شود. مقادیر مجاز: {', '.join(INDEX_TYPES)}")
+    vectors = normalize(embeddings)
+    n, dim = vectors.shape
+    metric = faiss.METRIC_INNER_PRODUCT
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, int(params.get("hnsw_m") or os.getenv("FAISS_HNSW_M", "32")), metric)
+        index.hnsw.efConstruction = int(params.get("ef_construction") or os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+    else:
+        nlist = int(params.get("nlist") or os.getenv("FAISS_NLIST", "0")) or int(4 * math.sqrt(n))
+        # برای آموزش k-means حدود ۳۹ نمونه به ازای هر خوشه لازم است
+        nlist = max(1, min(nlist, n // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            pq_m = _pq_subquantizers(dim, int(params.get("pq_m") or os.getenv("FAISS_PQ_M", "16")))
+            pq_nbits = int(params.get("pq_nbits") or os.getenv("FAISS_PQ_NBITS", "8"))
+            pq_nbits = max(1, min(pq_nbits, int(math.log2(max(n // 39, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, metric)
+        index.train(vectors)
+
+    if ids is not None:
+        # IndexIDMap روی IVF درست کار نمی‌کند چون IVF پس از حذف شماره‌ها را فشرده نمی‌کند
+        if index_type in ("flat", "hnsw"): index = faiss.IndexIDMap2(index)
+        index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    else:
+        index.add(vectors)
+    configure_search(index, **{k: params[k] for k in ("nprobe", "ef_search") if k in params})
+    return index
+
+
+def build_settings(index_type: str = None) -> dict:
+    """
+    نوع ایندکس و پارامترهای ساختی که build_index بدون آرگومان از متغیرهای محیطی برمی‌دارد
+    (فقط پارامترهای مربوط به همان نوع؛ nlist=0 یعنی مقدار خودکار بر اساس تعداد بردارها).
+    """
+    index_type = (index_type or os.getenv("FAISS_INDEX_TYPE", "flat")).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"نوع ایندکس '{index_type}' پشتیبانی نمی‌شود. مقادیر مجاز: {', '.join(INDEX_TYPES)}")
+    settings = {"index_type": index_type}
+    if index_type == "hnsw":
+        settings.update(hnsw_m=int(os.getenv("FAISS_HNSW_M", "32")),
+                        ef_construction=int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200")))
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        settings["nlist"] = int(os.getenv("FAISS_NLIST", "0"))
+    if index_type == "ivf_pq":
+        settings.update(pq_m=int(os.getenv("FAISS_PQ_M", "16")), pq_nbits=int(os.getenv("FAISS_PQ_NBITS", "8")))
+    return settings
+
+
+def index_type_of(index) -> str:
+    inner = _unwrap(index)
+    if isinstance(inner, faiss.IndexHNSW): return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ): return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVFFlat): return "ivf_flat"
+    return "flat"
+
+
+def add_vectors(index, embeddings, ids):
+    """بردارهای جدید را با شناسه‌هایشان به ایندکس ID-mapped موجود اضافه می‌کند."""
+    if len(ids): index.add_with_ids(normalize(embeddings), np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def remove_vectors(index, ids):
+    """
+    بردارهای با شناسه‌های داده شده را حذف می‌کند. HNSW از حذف پشتیبانی نمی‌کند؛
+    در آن حالت ایندکس از روی بردارهای باقی‌مانده دوباره ساخته می‌شود.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids): return index
+    if index_type_of(index) != "hnsw":
+        index.remove_ids(ids)
+        return index
+    all_ids = faiss.vector_to_array(index.id_map)
+    keep = ~np.isin(all_ids, ids)
+    inner = _unwrap(index)
+    vectors = inner.reconstruct_n(0, index.ntotal)[keep]
+    # M در سطوح بالای گراف برابر nb_neighbors(1) است
+    return build_index(vectors, "hnsw", ids=all_ids[keep], hnsw_m=inner.hnsw.nb_neighbors(1),
+                       ef_search=inner.hnsw.efSearch)
+
+
+def _unwrap(index):
+    # ایندکس‌های IndexIDMap شیء اصلی را در index.index نگه می‌دارند
+    return faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+
+
+def configure_search(index, nprobe: int = None, ef_search: int = None):
+    """پارامترهای زمان جستجو (FAISS_NPROBE برای IVF و FAISS_EF_SEARCH برای HNSW) را تنظیم می‌کند."""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf = None
+    if ivf is not None:
+        ivf.nprobe = min(int(nprobe or os.getenv("FAISS_NPROBE", "8")), ivf.nlist)
+    hnsw = _unwrap(index)
+    if isinstance(hnsw, faiss.IndexHNSW):
+        hnsw.hnsw.efSearch = int(ef_search or os.getenv("FAISS_EF_SEARCH", "64"))
+    return index
+
+
+def remove_id_range(index, start: int):
+    """همه بردارهای با شناسه >= start را حذف می‌کند (برای پاک کردن باقیمانده یک ingest نیمه‌کاره)."""
+    if index_type_of(index) == "hnsw":
+        all_ids = faiss.vector_to_array(index.id_map)
+        return remove_vectors(index, all_ids[all_ids >= start])
+    index.remove_ids(faiss.IDSelectorRange(start, 2**62))
+    return index
+
+
+def describe(index) -> str:
+    return f"{type(_unwrap(index)).__name__}(ntotal={index.ntotal}, dim={index.d})"